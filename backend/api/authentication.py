@@ -0,0 +1,116 @@
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import is_process_local
+
+TOKEN_KEY = 'foodgram:token:{}'
+
+# Счётчики меняются через update() без сигналов и не нужны для
+# аутентификации; отложенные поля не попадут и в user.save().
+DEFERRED_USER_FIELDS = ('user__recipes_count', 'user__followers_count')
+
+
+class TokenCache:
+    """Токены с пользователями в памяти процесса и в общем кэше.
+
+    В памяти процесса хранится не больше TOKEN_CACHE_SIZE последних
+    токенов, каждый не дольше TOKEN_CACHE_LOCAL_TTL секунд: сброс
+    в другом процессе виден здесь не позже, чем через этот срок.
+    В общем кэше (CACHES) токен хранится TOKEN_CACHE_TTL секунд
+    и удаляется при сбросе сразу. Если CACHES не общий для процессов
+    (LocMemCache), сброс в нём тоже виден только своему процессу,
+    поэтому срок там не больше TOKEN_CACHE_LOCAL_TTL.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._local = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                expires, data = entry
+                if expires > time.monotonic():
+                    self._local.move_to_end(key)
+                    return pickle.loads(data)
+                del self._local[key]
+        token = cache.get(TOKEN_KEY.format(key))
+        if token is not None:
+            self.remember(key, token)
+        return token
+
+    @staticmethod
+    def shared_ttl():
+        if is_process_local():
+            return min(
+                settings.TOKEN_CACHE_TTL, settings.TOKEN_CACHE_LOCAL_TTL
+            )
+        return settings.TOKEN_CACHE_TTL
+
+    def set(self, key, token):
+        cache.set(TOKEN_KEY.format(key), token, self.shared_ttl())
+        self.remember(key, token)
+
+    def remember(self, key, token):
+        ttl = settings.TOKEN_CACHE_LOCAL_TTL
+        if not ttl:
+            return
+        # Каждый запрос получает свою копию пользователя.
+        data = pickle.dumps(token, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, data)
+            self._local.move_to_end(key)
+            while len(self._local) > settings.TOKEN_CACHE_SIZE:
+                self._local.popitem(last=False)
+
+    def invalidate(self, *keys):
+        cache.delete_many([TOKEN_KEY.format(key) for key in keys])
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        keys = list(
+            Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+        )
+        if keys:
+            self.invalidate(*keys)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД для известных токенов.
+
+    Кэшируются только действующие токены активных пользователей.
+    Кэш сбрасывается сигналами при удалении токена (выход через
+    auth/token/logout, удаление в админке) и при сохранении
+    пользователя (смена пароля, деактивация, правка профиля).
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            try:
+                token = Token.objects.select_related('user').defer(
+                    *DEFERRED_USER_FIELDS
+                ).get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(
+                    _('User inactive or deleted.')
+                )
+            token_cache.set(key, token)
+        return token.user, token
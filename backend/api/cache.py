@@ -0,0 +1,184 @@
+import hashlib
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, urlencode
+from rest_framework.response import Response
+
+VERSION_KEY = 'foodgram:version:{}'
+RESPONSE_KEY = 'foodgram:response:{}'
+
+RECIPES_VERSION = 'recipes'
+REFERENCE_VERSION = 'reference'
+
+# Бэкенды CACHES, которые не видны другим процессам.
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def is_process_local():
+    return isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_CACHES)
+
+
+def recipe_version(pk):
+    return f'recipe:{pk}'
+
+
+def author_version(pk):
+    return f'author:{pk}'
+
+
+def get_version(name):
+    """Текущая версия набора данных name.
+
+    Версия хранится в общем кэше (CACHES) и равна времени последнего
+    изменения в наносекундах, поэтому её видят все процессы, которые
+    используют один и тот же бэкенд кэша.
+    """
+    return cache.get_or_set(VERSION_KEY.format(name), time.time_ns(), None)
+
+
+def get_versions(names):
+    keys = {VERSION_KEY.format(name): name for name in names}
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys.keys() - found.keys()}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {name: found[key] for key, name in keys.items()}
+
+
+def bump_version(*names):
+    """Помечает наборы данных names как изменённые."""
+    version = time.time_ns()
+    cache.set_many(
+        {VERSION_KEY.format(name): version for name in names}, None
+    )
+    return version
+
+
+class ProcessCache:
+    """Данные, построенные из БД и хранящиеся в памяти процесса.
+
+    Перестраиваются, когда меняется версия version_name в общем кэше
+    или когда снимок старше REFERENCE_CACHE_TTL секунд (на случай,
+    если кэш не общий для всех процессов).
+    """
+
+    version_name = None
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._built_at = 0
+
+    def build(self):
+        raise NotImplementedError
+
+    def is_fresh(self, version):
+        return (
+            version == self._version
+            and time.monotonic() - self._built_at
+            < settings.REFERENCE_CACHE_TTL
+        )
+
+    def refresh(self):
+        version = get_version(self.version_name)
+        if self.is_fresh(version):
+            return
+        with self._lock:
+            if not self.is_fresh(version):
+                self.build()
+                self._version = version
+                self._built_at = time.monotonic()
+
+    def invalidate(self):
+        bump_version(self.version_name)
+
+
+def response_key(request, name):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return RESPONSE_KEY.format(f'{name}:{request.get_host()}:{query}')
+
+
+def validators(key, versions):
+    digest = hashlib.md5(
+        f'{key}:{sorted(versions.items())}'.encode()
+    ).hexdigest()
+    return f'"{digest}"', max(versions.values()) // 10 ** 9
+
+
+def response_timeout():
+    """Срок ответа в кэше.
+
+    Если CACHES не общий для процессов, версии в нём меняются только
+    изменениями своего процесса, поэтому ответ хранится не дольше
+    RESPONSE_CACHE_LOCAL_TIMEOUT секунд.
+    """
+    if is_process_local():
+        return min(
+            settings.RESPONSE_CACHE_TIMEOUT,
+            settings.RESPONSE_CACHE_LOCAL_TIMEOUT
+        )
+    return settings.RESPONSE_CACHE_TIMEOUT
+
+
+def cached_response(request, name, versions, build, dependencies=None):
+    """Отдаёт ответ из кэша, пока не изменились версии его данных.
+
+    versions — имена версий, известные до построения ответа;
+    dependencies(data) возвращает имена версий, которые становятся
+    известны только из данных ответа (например, автор рецепта).
+    Ответ сопровождается ETag и Last-Modified, а условный GET
+    с совпадающими версиями получает 304 без сериализации.
+    """
+    key = response_key(request, name)
+    entry = cache.get(key)
+    if entry is not None and get_versions(entry['versions']) != (
+        entry['versions']
+    ):
+        entry = None
+    if entry is not None:
+        current = entry['versions']
+    elif dependencies is None and not is_process_local():
+        # Без сохранённого ответа версии из кэша процесса могут быть
+        # устаревшими, и 304 отдавать нельзя.
+        current = get_versions(versions)
+    else:
+        current = None
+
+    if current is not None:
+        etag, last_modified = validators(key, current)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            return not_modified
+
+    if entry is not None:
+        response = Response(entry['data'])
+    else:
+        if current is None:
+            current = get_versions(versions)
+        response = build()
+        if response.status_code != 200:
+            return response
+        if dependencies is not None:
+            current.update(get_versions(dependencies(response.data)))
+        cache.set(
+            key,
+            {'versions': current, 'data': response.data},
+            response_timeout()
+        )
+        etag, last_modified = validators(key, current)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
@@ -1,25 +1,28 @@
-from django_filters.rest_framework import (BooleanFilter, FilterSet,
+from django.db.models import Exists, F, OuterRef
+from django_filters.rest_framework import (BooleanFilter, CharFilter,
+                                           ChoiceFilter, FilterSet,
                                            ModelChoiceFilter,
-                                           ModelMultipleChoiceFilter, filters)
+                                           MultipleChoiceFilter)
 from rest_framework.exceptions import AuthenticationFailed
 
-from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.constant import TAGS_MASK_BITS
+from recipes.models import Recipe, TagInRecipe, User
+from recipes.search import search_recipes
+from recipes.trending import order_by_trending
 
+from .registry import tag_registry
 
-class IngredientSearchFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='icontains')
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+def tag_slug_choices():
+    return tag_registry.slug_choices()
 
 
 class RecipeFilter(FilterSet):
     author = ModelChoiceFilter(queryset=User.objects.all())
-    tags = ModelMultipleChoiceFilter(
+    tags = MultipleChoiceFilter(
         field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+        choices=tag_slug_choices,
+        method='get_tags'
     )
     is_favorited = BooleanFilter(
         method='get_is_favorited'
@@ -27,6 +30,13 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = CharFilter(method='get_search')
+    # Объявлен после search, чтобы явный порядок заменял порядок
+    # по релевантности.
+    ordering = ChoiceFilter(
+        choices=(('trending', 'trending'),),
+        method='get_ordering'
+    )
 
     class Meta:
         model = Recipe
@@ -34,9 +44,31 @@ class RecipeFilter(FilterSet):
             'author',
             'is_in_shopping_cart',
             'tags',
-            'is_favorited'
+            'is_favorited',
+            'search',
+            'ordering'
         )
 
+    def get_tags(self, queryset, name, value):
+        """Рецепты, у которых есть хотя бы один из выбранных тегов.
+
+        Если все id тегов помещаются в битовую маску, условие проверяется
+        по колонке tags_mask без соединений, иначе — через EXISTS.
+        В обоих случаях рецепты не дублируются.
+        """
+        tag_ids = tag_registry.ids_for_slugs(value)
+        if all(tag_id < TAGS_MASK_BITS for tag_id in tag_ids):
+            return queryset.alias(
+                tags_match=F('tags_mask').bitand(
+                    Recipe.get_tags_mask(tag_ids)
+                )
+            ).filter(tags_match__gt=0)
+        return queryset.filter(Exists(
+            TagInRecipe.objects.filter(
+                recipe=OuterRef('pk'), tag_id__in=tag_ids
+            )
+        ))
+
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -53,14 +85,16 @@ class RecipeFilter(FilterSet):
             raise AuthenticationFailed('Необходимо авторизоваться!')
         return queryset
 
-    def filter_queryset(self, queryset):
-        tags = self.request.GET.getlist('tags')
-        if not tags:
-            return queryset
-        existing_tags = Tag.objects.filter(slug__in=tags)
-        if existing_tags:
-            filtered_queryset = queryset.filter(tags__in=existing_tags)
-            if not filtered_queryset:
-                return queryset
-            return filtered_queryset
-        return queryset
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам.
+
+        Найденные рецепты упорядочены по релевантности.
+        """
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        """Популярные сейчас рецепты по счёту с затуханием.
+
+        Рецепты без счёта (давно никем не добавленные) не выводятся.
+        """
+        return order_by_trending(queryset)
@@ -0,0 +1,251 @@
+import json
+import math
+import random
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag, User
+
+# (название, вес, от имени пользователя, построитель пути)
+ENDPOINTS = (
+    ('recipes: list anonymous', 25, False,
+     lambda data, rng: f'/api/recipes/?page={rng.randint(1, 5)}'),
+    ('recipes: list', 12, True,
+     lambda data, rng: f'/api/recipes/?page={rng.randint(1, 5)}'),
+    ('recipes: tag filter', 10, False,
+     lambda data, rng: f'/api/recipes/?tags={rng.choice(data["tags"])}'),
+    ('recipes: detail anonymous', 15, False,
+     lambda data, rng: f'/api/recipes/{rng.choice(data["recipes"])}/'),
+    ('recipes: detail', 5, True,
+     lambda data, rng: f'/api/recipes/{rng.choice(data["recipes"])}/'),
+    ('recipes: favorited', 3, True,
+     lambda data, rng: '/api/recipes/?is_favorited=1'),
+    ('recipes: trending', 4, False,
+     lambda data, rng: f'/api/recipes/?ordering=trending&page='
+                       f'{rng.randint(1, 3)}'),
+    ('recipes: search', 4, False,
+     lambda data, rng: f'/api/recipes/?search={rng.choice(data["words"])}'),
+    ('ingredients: search', 12, False,
+     lambda data, rng: f'/api/ingredients/?name={rng.choice(data["words"])}'),
+    ('tags: list', 5, False, lambda data, rng: '/api/tags/'),
+    ('users: subscriptions', 6, True,
+     lambda data, rng: '/api/users/subscriptions/?recipes_limit=3'),
+    ('users: me', 4, True, lambda data, rng: '/api/users/me/'),
+    ('recipes: shopping list', 3, True,
+     lambda data, rng: '/api/recipes/download_shopping_cart/'),
+)
+
+
+class Rollback(Exception):
+    """Откатывает временные данные замера."""
+
+
+def percentile(values, share):
+    """Процентиль методом ближайшего ранга по отсортированному списку."""
+    if not values:
+        return None
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a weighted mix of API requests through the WSGI handler or '
+        'against a running server and print throughput and p50/p95/p99 '
+        'latency per endpoint as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=20,
+            help='Number of users whose tokens authenticated requests use',
+        )
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server; requests go over HTTP '
+                 'instead of the in-process handler',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Parallel HTTP clients when --url is given',
+        )
+        parser.add_argument('--output', help='Write the report to this file')
+        parser.add_argument(
+            '--baseline',
+            help='Report of an earlier run to compare p50/p95/p99 with',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        data = self.sample_data(rng, options['users'])
+        weights = [weight for _, weight, _, _ in ENDPOINTS]
+        plan = []
+        for _ in range(options['warmup'] + options['requests']):
+            name, _, as_user, path = rng.choices(ENDPOINTS, weights)[0]
+            token = rng.choice(data['tokens']) if as_user else None
+            plan.append((name, token, path(data, rng)))
+        warmup, plan = plan[:options['warmup']], plan[options['warmup']:]
+        if options['url']:
+            run = partial(
+                self.run_remote, options['url'], options['concurrency']
+            )
+        else:
+            run = self.run_local
+        run(warmup)
+        started = time.perf_counter()
+        results = run(plan)
+        elapsed = time.perf_counter() - started
+        report = self.build_report(results, elapsed, options)
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def run_local(self, plan):
+        """Запросы по очереди через обработчик Django в этом процессе."""
+        clients = {}
+        results = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, token, path in plan:
+                if token not in clients:
+                    clients[token] = Client(
+                        HTTP_AUTHORIZATION=f'Token {token}'
+                    ) if token else Client()
+                started = time.perf_counter()
+                response = clients[token].get(path)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                results.append((
+                    name, time.perf_counter() - started,
+                    response.status_code >= 400
+                ))
+        return results
+
+    def run_remote(self, url, concurrency, plan):
+        """Запросы к запущенному серверу в concurrency потоков."""
+        def fetch(item):
+            name, token, path = item
+            request = urllib.request.Request(url.rstrip('/') + quote(
+                path, safe='/?=&'
+            ))
+            if token:
+                request.add_header('Authorization', f'Token {token}')
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                failed = False
+            except (urllib.error.URLError, OSError):
+                failed = True
+            return name, time.perf_counter() - started, failed
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(fetch, plan))
+
+    def sample_data(self, rng, users):
+        recipes = list(
+            Recipe.objects.order_by('-id').values_list('id', flat=True)[:5000]
+        )
+        tags = list(Tag.objects.values_list('slug', flat=True))
+        names = list(
+            Ingredient.objects.order_by('id').values_list('name', flat=True)
+        )
+        words = [
+            name.split()[0][:3]
+            for name in rng.sample(names, min(len(names), 200))
+        ]
+        user_ids = list(User.objects.filter(
+            shoppingcart__isnull=False
+        ).distinct().order_by('id').values_list('id', flat=True)[:users])
+        if not recipes or not tags or not words or not user_ids:
+            raise CommandError(
+                'Нужны рецепты, теги, ингредиенты и пользователи с корзиной; '
+                'заполните базу командой seed_foodgram'
+            )
+        tokens = [
+            Token.objects.get_or_create(user_id=user_id)[0].key
+            for user_id in user_ids
+        ]
+        rng.shuffle(recipes)
+        return {
+            'recipes': recipes, 'tags': tags, 'words': words, 'tokens': tokens
+        }
+
+    def build_report(self, results, elapsed, options):
+        timings = defaultdict(list)
+        errors = defaultdict(int)
+        for name, duration, failed in results:
+            timings[name].append(duration)
+            errors[name] += failed
+        endpoints = {}
+        for name, values in sorted(timings.items()):
+            values.sort()
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'mean_ms': round(sum(values) / len(values) * 1000, 2),
+                'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            }
+        return {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'target': options['url'] or 'in-process',
+            'concurrency': options['concurrency'] if options['url'] else 1,
+            'seed': options['seed'],
+            'requests': len(results),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': (
+                round(len(results) / elapsed, 1) if elapsed else None
+            ),
+            'endpoints': endpoints,
+        }
+
+    def compare(self, report, path):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        for name, current in report['endpoints'].items():
+            previous = baseline.get('endpoints', {}).get(name)
+            if not previous:
+                continue
+            current['change'] = {
+                key: round(current[key] / previous[key] - 1, 3)
+                for key in ('p50_ms', 'p95_ms', 'p99_ms') if previous[key]
+            }
+        if baseline.get('throughput_rps'):
+            report['throughput_change'] = round(
+                report['throughput_rps'] / baseline['throughput_rps'] - 1, 3
+            )
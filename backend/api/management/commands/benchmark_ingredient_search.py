@@ -0,0 +1,130 @@
+import json
+import random
+import statistics
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from api.search import ingredient_index
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+from .benchmark_api import Rollback, git_revision, percentile
+
+BATCH_SIZE = 10000
+
+
+def orm_search(name):
+    """Прежний путь: name__icontains по таблице и сериализация."""
+    return IngredientSerializer(
+        Ingredient.objects.filter(name__icontains=name), many=True
+    ).data
+
+
+def timings_report(timings):
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare ingredient search through the in-process index with the '
+        'former name__icontains query on the bundled catalog and on a '
+        'synthetic catalog of --rows ingredients, and print latency as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000000,
+            help='Size of the synthetic catalog',
+        )
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the report to this file')
+
+    def handle(self, *args, **options):
+        locmem = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ingredient-search',
+        }}
+        with override_settings(CACHES=locmem):
+            try:
+                with transaction.atomic():
+                    report = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def run(self, options):
+        """Временные данные: удаляются откатом транзакции."""
+        rng = random.Random(options['seed'])
+        # Каталог из data/ дозагружается, если его ещё нет в базе.
+        call_command('load_ingredients', 'ingredients.csv', stdout=StringIO())
+        names = list(
+            Ingredient.objects.order_by('id').values_list('name', flat=True)
+        )
+        queries = []
+        for name in rng.sample(names, min(options['queries'], len(names))):
+            start = rng.randrange(max(len(name) - 3, 1))
+            # Начало названия и вхождение с середины слова.
+            queries.extend((name[:3], name[start:start + 4]))
+        catalogs = {'bundled': self.measure(queries)}
+        number = 0
+        while len(names) + number < options['rows']:
+            size = min(BATCH_SIZE, options['rows'] - len(names) - number)
+            Ingredient.objects.bulk_create(
+                Ingredient(
+                    name=f'{names[(number + index) % len(names)]} '
+                         f'{number + index}',
+                    measurement_unit='г',
+                ) for index in range(size)
+            )
+            number += size
+        catalogs['synthetic'] = self.measure(queries)
+        return {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'queries': len(queries),
+            'catalogs': catalogs,
+        }
+
+    def measure(self, queries):
+        ingredient_index.invalidate()
+        started = time.perf_counter()
+        ingredient_index.refresh()
+        build = time.perf_counter() - started
+        index, orm = [], []
+        found_total = expected_total = 0
+        for query in queries:
+            started = time.perf_counter()
+            found = ingredient_index.search(query)
+            index.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            expected = orm_search(query)
+            orm.append(time.perf_counter() - started)
+            found_total += len(found)
+            expected_total += len(expected)
+        return {
+            'rows': Ingredient.objects.count(),
+            'index_build_ms': round(build * 1000, 1),
+            'index': timings_report(index),
+            'orm': timings_report(orm),
+            # Индекс сравнивает без учёта регистра и ё, поэтому находит
+            # не меньше icontains.
+            'matches': {'index': found_total, 'orm': expected_total},
+        }
@@ -0,0 +1,121 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import Cursor
+
+from api.pagination import RecipeCursorPagination
+from recipes.models import Recipe, User
+
+from .benchmark_api import git_revision, percentile
+
+FEED = '/api/recipes/'
+
+
+class Command(BaseCommand):
+    help = (
+        'Request the same pages of the recipe feed in page-number and cursor '
+        'mode on a seeded database and print latency and query counts as '
+        'JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages', type=int, nargs='+', default=[1, 100, 10000]
+        )
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Write the report to this file')
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by('id').first()
+        total = Recipe.objects.count()
+        if user is None or not total:
+            raise CommandError(
+                'Нужны пользователи и рецепты; заполните базу командой '
+                'seed_foodgram'
+            )
+        # Анонимная лента берётся из кэша ответов, поэтому от имени
+        # пользователя.
+        client = Client(HTTP_AUTHORIZATION=(
+            f'Token {Token.objects.get_or_create(user=user)[0].key}'
+        ))
+        limit = options['limit']
+        pages = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for page in options['pages']:
+                offset = (page - 1) * limit
+                if offset >= total:
+                    pages[page] = {
+                        'skipped': f'в базе {total} рецептов, нужно больше '
+                                   f'{offset}'
+                    }
+                    continue
+                modes = {
+                    'page_number': f'{FEED}?page={page}&limit={limit}',
+                    'cursor': self.cursor_path(offset, limit),
+                }
+                pages[page] = {
+                    mode: self.measure(client, path, options['repeat'])
+                    for mode, path in modes.items()
+                }
+                pages[page]['same_results'] = (
+                    pages[page]['page_number'].pop('ids')
+                    == pages[page]['cursor'].pop('ids')
+                )
+        report = {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'recipes': total,
+            'limit': limit,
+            'repeat': options['repeat'],
+            'pages': pages,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def cursor_path(self, offset, limit):
+        """Ссылка курсора на ту же страницу, что и page в режиме номеров.
+
+        Клиент получает её из поля next предыдущей страницы; здесь
+        позиция — id последнего рецепта предыдущей страницы.
+        """
+        paginator = RecipeCursorPagination()
+        paginator.base_url = f'{FEED}?limit={limit}'
+        if not offset:
+            return f'{FEED}?cursor=&limit={limit}'
+        position = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        )[offset - 1]
+        return paginator.encode_cursor(
+            Cursor(offset=0, reverse=False, position=str(position))
+        )
+
+    def measure(self, client, path, repeat):
+        client.get(path)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        # Журнал запросов очищается в начале каждого запроса.
+        count = len(queries)
+        if response.status_code != 200:
+            raise CommandError(f'{path}: HTTP {response.status_code}')
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            client.get(path)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return {
+            'ids': [recipe['id'] for recipe in response.data['results']],
+            'queries': count,
+            'p50_ms': round(statistics.median(timings) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        }
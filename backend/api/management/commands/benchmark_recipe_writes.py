@@ -0,0 +1,149 @@
+import base64
+import json
+import statistics
+import tempfile
+import time
+import uuid
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Tag, User
+
+from .benchmark_api import Rollback, git_revision, percentile
+
+
+def image_data():
+    content = BytesIO()
+    Image.new('RGB', (32, 32)).save(content, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        content.getvalue()
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        'Create and edit temporary recipes with different numbers of '
+        'ingredients and print POST and PATCH query counts and p50/p95 '
+        'latency as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--counts', type=int, nargs='+', default=[1, 10, 50, 200],
+            help='Numbers of ingredients per recipe',
+        )
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', help='Write the report to this file')
+
+    def handle(self, *args, **options):
+        locmem = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'recipe-writes',
+        }}
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            ALLOWED_HOSTS=['testserver'], CACHES=locmem, MEDIA_ROOT=media_root
+        ):
+            try:
+                with transaction.atomic():
+                    report = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def create_dataset(self, ingredients):
+        """Временные данные: удаляются откатом транзакции."""
+        prefix = f'writes-{uuid.uuid4().hex[:8]}'
+        author = User.objects.create(
+            username=prefix, email=f'{prefix}@example.com',
+            first_name='writes', last_name='writes',
+        )
+        tag = Tag.objects.create(
+            name=prefix, slug=prefix, color=f'#{uuid.uuid4().hex[:6]}'
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{prefix} {number}', measurement_unit='г')
+            for number in range(ingredients)
+        )
+        ingredient_ids = list(Ingredient.objects.filter(
+            name__startswith=prefix
+        ).order_by('id').values_list('id', flat=True))
+        return author, tag, ingredient_ids
+
+    def run(self, options):
+        author, tag, ingredient_ids = self.create_dataset(
+            max(options['counts'])
+        )
+        client = Client(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=author).key}'
+        )
+        image = image_data()
+        results = {}
+        for count in options['counts']:
+            def payload(amount):
+                return json.dumps({
+                    'name': f'{count} ingredients',
+                    'text': 'writes',
+                    'cooking_time': 10,
+                    'image': image,
+                    'tags': [tag.pk],
+                    'ingredients': [
+                        {'id': ingredient_id, 'amount': amount}
+                        for ingredient_id in ingredient_ids[:count]
+                    ],
+                })
+
+            post = self.measure(
+                client.post, '/api/recipes/', payload, options['repeat']
+            )
+            # Правка меняет количество каждого ингредиента.
+            patch = self.measure(
+                client.patch, f'/api/recipes/{post.pop("recipe")}/', payload,
+                options['repeat']
+            )
+            patch.pop('recipe')
+            results[count] = {'post': post, 'patch': patch}
+        return {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'ingredients': results,
+        }
+
+    def measure(self, method, path, payload, repeat):
+        """Запросы вместе с работой после фиксации (индексы, кэши)."""
+        timings = []
+        for number in range(repeat + 1):
+            data = payload(number + 1)
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                with TestCase.captureOnCommitCallbacks(execute=True):
+                    response = method(
+                        path, data, content_type='application/json'
+                    )
+                duration = time.perf_counter() - started
+            if response.status_code not in (200, 201):
+                raise CommandError(
+                    f'{path}: HTTP {response.status_code} {response.data}'
+                )
+            # Первый запрос прогревает кэши процесса и не учитывается.
+            if number:
+                timings.append(duration)
+            count = len(queries)
+        timings.sort()
+        return {
+            'recipe': response.data['id'],
+            'queries': count,
+            'p50_ms': round(statistics.median(timings) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        }
@@ -0,0 +1,184 @@
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from api.shopping_list import SHOPPING_LIST_FILENAME, SHOPPING_LIST_TITLE
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, User)
+
+from .benchmark_api import Rollback, git_revision
+
+FORMATS = ('txt', 'csv', 'json')
+
+
+def legacy_export(user):
+    """Прежняя выгрузка: весь список собирается в одну строку до ответа."""
+    ingredient_list = SHOPPING_LIST_TITLE
+
+    ingredients = IngredientInRecipe.objects.filter(
+        recipe__shopping_cart__user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).annotate(amount=Sum('amount'))
+
+    for ingredient in ingredients:
+        ingredient_name = ingredient['ingredient__name']
+        measurement_unit = ingredient['ingredient__measurement_unit']
+        amount = ingredient['amount']
+        ingredient_list += (
+            f'\n{ingredient_name} - {amount} {measurement_unit}'
+        )
+
+    response = HttpResponse(ingredient_list, content_type='text/plain')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{SHOPPING_LIST_FILENAME}.txt"'
+    )
+    return response
+
+
+def read(fetch):
+    """Время до первого байта, полное время и размер ответа."""
+    started = time.perf_counter()
+    response = fetch()
+    if response.streaming:
+        chunks = iter(response.streaming_content)
+        size = len(next(chunks, b''))
+        first_byte = time.perf_counter() - started
+        size += sum(len(chunk) for chunk in chunks)
+    else:
+        first_byte = time.perf_counter() - started
+        size = len(response.content)
+    return first_byte, time.perf_counter() - started, size
+
+
+class Command(BaseCommand):
+    help = (
+        'Export a temporary shopping list of the given size in every format '
+        'and with the former in-memory implementation, and print time to '
+        'first byte, total time and peak Python memory as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=20000,
+            help='Number of lines in the shopping list',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=50,
+            help='Recipes in the cart; each ingredient is in two of them',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help='Write the report to this file')
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            try:
+                with transaction.atomic():
+                    report = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def create_dataset(self, ingredients, recipes):
+        """Временные данные: удаляются откатом транзакции."""
+        prefix = f'shopping-{uuid.uuid4().hex[:8]}'
+        user = User.objects.create(
+            username=prefix, email=f'{prefix}@example.com',
+            first_name='shopping', last_name='shopping',
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f'{prefix} {number:06}', measurement_unit='г'
+            ) for number in range(ingredients)
+        )
+        ingredient_ids = list(Ingredient.objects.filter(
+            name__startswith=prefix
+        ).order_by('id').values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=user, name=f'{prefix} {number}', text='shopping',
+                cooking_time=10, image='recipes/images/shopping.png',
+            ) for number in range(recipes)
+        )
+        recipe_ids = list(Recipe.objects.filter(
+            author=user
+        ).order_by('id').values_list('id', flat=True))
+        IngredientInRecipe.objects.bulk_create((
+            IngredientInRecipe(
+                recipe_id=recipe_ids[(number + shift) % recipes],
+                ingredient_id=ingredient_id,
+                amount=10,
+            )
+            for number, ingredient_id in enumerate(ingredient_ids)
+            for shift in range(min(recipes, 2))
+        ), batch_size=5000)
+        for recipe_id in recipe_ids:
+            # Сигнал переносит состав рецепта в итоги списка покупок.
+            ShoppingCart.objects.create(user=user, recipe_id=recipe_id)
+        return user
+
+    def run(self, options):
+        user = self.create_dataset(options['ingredients'], options['recipes'])
+        client = Client(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}'
+        )
+        variants = {
+            f'streaming {export_format}': (
+                lambda export_format=export_format: client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': export_format}
+                )
+            ) for export_format in FORMATS
+        }
+        variants['legacy txt'] = lambda: legacy_export(user)
+
+        results = {}
+        for name, fetch in variants.items():
+            read(fetch)
+            timings = [read(fetch) for _ in range(options['repeat'])]
+            # Замер памяти отдельно: tracemalloc замедляет выполнение.
+            tracemalloc.start()
+            try:
+                current, _ = tracemalloc.get_traced_memory()
+                read(fetch)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            results[name] = {
+                'bytes': timings[0][2],
+                'first_byte_ms': round(
+                    statistics.median(item[0] for item in timings) * 1000, 2
+                ),
+                'total_ms': round(
+                    statistics.median(item[1] for item in timings) * 1000, 2
+                ),
+                'peak_memory_kb': round((peak - current) / 1024, 1),
+            }
+        return {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'ingredients': options['ingredients'],
+            'recipes': options['recipes'],
+            'repeat': options['repeat'],
+            'variants': results,
+        }
@@ -0,0 +1,77 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes.similarity import (block_bounds, block_neighbors, load_catalog,
+                                save_neighbors)
+
+_catalog = None
+
+
+def init_worker(catalog):
+    global _catalog
+    _catalog = catalog
+
+
+def compute(bounds, count):
+    return block_neighbors(_catalog, *bounds, count)
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the similar recipes table from ingredient and tag overlap '
+        'using vectorized blocks, optionally in several processes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=settings.SIMILAR_RECIPES_COUNT,
+            help='Neighbors stored per recipe',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes; 1 computes in this process',
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            help='Recipes per block; by default the block matrix is ~32 MB',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        catalog = load_catalog()
+        bounds = block_bounds(catalog, options['block_size'])
+        if options['workers'] > 1 and len(bounds) > 1:
+            # Процессы-воркеры не работают с БД и не должны наследовать
+            # открытые соединения.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=init_worker,
+                initargs=(catalog,)
+            ) as executor:
+                blocks = list(executor.map(
+                    compute, bounds, [options['top']] * len(bounds)
+                ))
+        else:
+            blocks = [
+                block_neighbors(catalog, start, end, options['top'])
+                for start, end in bounds
+            ]
+        computed = time.monotonic()
+        saved = save_neighbors(blocks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {len(catalog["ids"])}, блоков: {len(bounds)}, '
+            f'соседей сохранено: {saved}; расчёт '
+            f'{computed - started:.1f} с, запись '
+            f'{time.monotonic() - computed:.1f} с'
+        ))
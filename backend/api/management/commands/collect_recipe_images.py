@@ -0,0 +1,84 @@
+import posixpath
+import time
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.thumbnails import THUMBNAILS_DIR
+
+IMAGES_DIR = Recipe._meta.get_field('image').upload_to
+
+
+def walk(storage, directory):
+    """Рекурсивно перечисляет файлы каталога хранилища."""
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk(storage, posixpath.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete recipe images and thumbnails that no recipe references '
+        'and report deduplication savings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report, do not delete anything',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Keep unreferenced files younger than this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        references = Counter(
+            Recipe.objects.exclude(image='').values_list('image', flat=True)
+        )
+        thumbnails = set()
+        for sizes in Recipe.objects.exclude(thumbnails={}).values_list(
+            'thumbnails__sizes', flat=True
+        ).iterator():
+            for variants in (sizes or {}).values():
+                thumbnails.update(variants.values())
+        image_storage = Recipe._meta.get_field('image').storage
+        self.collect(
+            'Картинки', image_storage, IMAGES_DIR, references, options
+        )
+        self.collect(
+            'Превью', default_storage, THUMBNAILS_DIR,
+            Counter(thumbnails), options
+        )
+
+    def collect(self, label, storage, directory, references, options):
+        deadline = time.time() - options['min_age']
+        files = physical = logical = orphans = orphan_bytes = 0
+        for name in walk(storage, directory):
+            size = storage.size(name)
+            files += 1
+            physical += size
+            logical += size * references[name]
+            if references[name]:
+                continue
+            if storage.get_modified_time(name).timestamp() > deadline:
+                continue
+            orphans += 1
+            orphan_bytes += size
+            if not options['dry_run']:
+                storage.delete(name)
+        action = 'к удалению' if options['dry_run'] else 'удалено'
+        self.stdout.write(
+            f'{label}: файлов {files}, ссылок {sum(references.values())}, '
+            f'на диске {physical} байт, без дедупликации {logical} байт, '
+            f'{action} {orphans} файлов ({orphan_bytes} байт)'
+        )
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from recipes.models import Recipe
+from recipes.thumbnails import generate_thumbnails
+
+
+def generate(recipe_id, overwrite):
+    close_old_connections()
+    try:
+        return generate_thumbnails(recipe_id, overwrite)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Generate missing thumbnail and WebP variants of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants even if they are up to date',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.THUMBNAIL_WORKERS
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'thumbnails'
+        ).order_by('id')
+        recipe_ids = [
+            recipe.id for recipe in recipes.iterator()
+            if options['force'] or not recipe.thumbnails_ready
+        ]
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                (recipe_id, executor.submit(
+                    generate, recipe_id, options['force']
+                ))
+                for recipe_id in recipe_ids
+            ]
+            for recipe_id, future in futures:
+                try:
+                    future.result()
+                    done += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'Рецепт {recipe_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Превью построены: {done}, ошибок: {failed}'
+        ))
@@ -1,46 +1,157 @@
 import csv
 import json
+import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from api.search import ingredient_index
+from recipes.constant import MAX_LENGTH
 from recipes.models import Ingredient
 
+FORMATS = ('csv', 'json', 'ndjson')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1] if len(row) > 1 else ''
+
+
+def iter_json_array(file):
+    """Потоково разбирает JSON-массив, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer = (buffer + chunk).lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise CommandError('Ожидался JSON-массив')
+            buffer = buffer[1:].lstrip()
+            started = True
+        while buffer:
+            if buffer[0] == ']':
+                return
+            if buffer[0] == ',':
+                buffer = buffer[1:].lstrip()
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON')
+                break
+            yield item
+            buffer = buffer[end:].lstrip()
+        if not chunk:
+            raise CommandError('Неожиданный конец JSON')
+
+
+def read_json(file):
+    for item in iter_json_array(file):
+        yield item.get('name', ''), item.get('measurement_unit', '')
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            item = json.loads(line)
+            yield item.get('name', ''), item.get('measurement_unit', '')
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'ndjson': read_ndjson}
+
 
 class Command(BaseCommand):
-    help = 'Import json and csv files into database'
+    help = (
+        'Stream CSV, JSON or NDJSON ingredient catalogs into the database '
+        'in batches, skipping ingredients that already exist'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=['ingredients.json'],
+            help='Files to import; bare names are looked up in data/',
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Input format; guessed from the file extension by default',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count new ingredients without writing them',
+        )
 
     def handle(self, *args, **options):
-        if Ingredient.objects.exists():
-            self.stdout.write(self.style.SUCCESS(
-                'Данные уже загружены, нет необходимости повторной загрузки.'
-            ))
-            return
+        self.totals = {'read': 0, 'invalid': 0, 'existing': 0, 'created': 0}
+        self.started = time.monotonic()
+        for path in options['paths']:
+            if not os.path.exists(path):
+                path = os.path.join(settings.BASE_DIR, 'data', path)
+            file_format = options['format'] or (
+                os.path.splitext(path)[1].lstrip('.').lower()
+            )
+            if file_format not in READERS:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+            with open(path, 'r', encoding='utf-8') as file:
+                rows = READERS[file_format](file)
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    self.load_batch(batch, options['dry_run'])
+                    self.report(options['verbosity'] > 1)
+        if self.totals['created'] and not options['dry_run']:
+            ingredient_index.invalidate()
+        self.report(True)
 
-        with open(
-            f'{settings.BASE_DIR}/data/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as csv_file:
-            csv_data = csv.reader(csv_file)
+    def load_batch(self, batch, dry_run):
+        keys = set()
+        valid = 0
+        for name, measurement_unit in batch:
+            name, measurement_unit = name.strip(), measurement_unit.strip()
+            if (
+                not name or not measurement_unit
+                or len(name) > MAX_LENGTH or len(measurement_unit) > MAX_LENGTH
+            ):
+                continue
+            valid += 1
+            keys.add((name, measurement_unit))
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in keys},
+            measurement_unit__in={unit for _, unit in keys}
+        ).values_list('name', 'measurement_unit'))
+        new = keys - existing
+        self.totals['read'] += len(batch)
+        self.totals['invalid'] += len(batch) - valid
+        self.totals['existing'] += valid - len(new)
+        self.totals['created'] += len(new)
+        if new and not dry_run:
             Ingredient.objects.bulk_create(
-                Ingredient(name=row[0], measurement_unit=row[1])
-                for row in csv_data
+                (
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in sorted(new)
+                ),
+                ignore_conflicts=True
             )
 
-        with open(
-            f'{settings.BASE_DIR}/data/ingredients.json',
-            'r',
-            encoding='utf-8'
-        ) as json_file:
-
-            json_data = json.load(json_file)
-            for item in json_data:
-                Ingredient.objects.create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit']
-                )
-        self.stdout.write(self.style.SUCCESS(
-
-            'Успешно выгружены данные с csv и json файла'
-        ))
+    def report(self, force):
+        if not force:
+            return
+        elapsed = time.monotonic() - self.started
+        rate = self.totals['read'] / elapsed if elapsed else 0
+        self.stdout.write(
+            'Прочитано {read}, новых {created}, уже были {existing}, '
+            'некорректных {invalid}'.format(**self.totals)
+            + f' ({rate:.0f} строк/с)'
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Recompute materialized shopping list totals for all users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report totals that differ from the shopping carts '
+                 'and exit with an error if there are any',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingListItem.objects.compute_totals().iterator()
+        }
+        if options['check']:
+            self.check_totals(expected)
+            return
+
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=total
+                    ) for (user_id, ingredient_id), total in expected.items()
+                ),
+                batch_size=options['batch_size']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Итоги списков покупок пересчитаны: {len(expected)} строк'
+        ))
+
+    def check_totals(self, expected):
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = 0
+        for key in sorted(expected.keys() | actual.keys()):
+            if expected.get(key, 0) != actual.get(key, 0):
+                mismatches += 1
+                user_id, ingredient_id = key
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'ожидалось {expected.get(key, 0)}, '
+                    f'записано {actual.get(key, 0)}'
+                )
+        if mismatches:
+            raise CommandError(f'Расхождений: {mismatches}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart, User
+from users.models import Subscribe
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscribe, 'author'),
+)
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Fix drift of denormalized recipe and user counters and of recipe '
+        'tag masks in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fields = [
+            (model, counter, count_subquery(related_model, field))
+            for model, counter, related_model, field in COUNTERS
+        ]
+        # Маска тегов тоже выводится из других таблиц и может разойтись
+        # с TagInRecipe, например после правки напрямую в БД.
+        fields.append((Recipe, 'tags_mask', Recipe.tags_mask_subquery()))
+        for model, counter, actual in fields:
+            fixed = self.reconcile(
+                model, counter, actual, options['batch_size']
+            )
+            self.stdout.write(
+                f'{model._meta.label}.{counter}: исправлено {fixed}'
+            )
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
+
+    @staticmethod
+    def reconcile(model, counter, actual, batch_size):
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', counter)
+                .annotate(actual=actual)[:batch_size]
+            )
+            if not batch:
+                return fixed
+            last_pk = batch[-1].pk
+            drifted = []
+            for obj in batch:
+                if getattr(obj, counter) != obj.actual:
+                    setattr(obj, counter, obj.actual)
+                    drifted.append(obj)
+            model.objects.bulk_update(drifted, (counter,))
+            fixed += len(drifted)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from recipes.models import TrendingRecipe
+from recipes.trending import renormalize
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the trending score epoch to now and drop decayed scores; '
+        'run periodically, e.g. daily'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute scores from favorites and shopping carts',
+        )
+
+    def handle(self, *args, **options):
+        kept, removed = renormalize(options['rebuild'])
+        if connection.vendor == 'postgresql':
+            # После обновления всех строк карта видимости сброшена,
+            # без неё индекс trending_score_idx читается с таблицей.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'VACUUM ANALYZE {TrendingRecipe._meta.db_table}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетов популярности: {kept}, удалено угасших: {removed}'
+        ))
@@ -0,0 +1,296 @@
+import random
+import time
+import zlib
+from collections import Counter, defaultdict
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import RECIPES_VERSION, REFERENCE_VERSION, bump_version
+from api.registry import tag_registry
+from api.search import ingredient_index
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag, TagInRecipe,
+                            User)
+from recipes.search import update_search_index
+from recipes.trending import renormalize
+from users.models import Subscribe
+
+TAGS = (
+    ('Завтрак', 'breakfast', '#E26C2D'),
+    ('Обед', 'lunch', '#49B64E'),
+    ('Ужин', 'dinner', '#8775D2'),
+    ('Десерт', 'dessert', '#F2A7C3'),
+    ('Суп', 'soup', '#C9A227'),
+    ('Салат', 'salad', '#2EA8A1'),
+    ('Выпечка', 'baking', '#B5651D'),
+    ('Вегетарианское', 'vegetarian', '#3F7D20'),
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Запеканка', 'Паста', 'Каша')
+AMOUNTS = (1, 2, 3, 5, 10, 50, 100, 150, 200, 250, 500)
+
+
+def zipf_weights(size, exponent=1.1):
+    """Накопленные веса: первые элементы популярнее остальных."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(size)))
+
+
+def weighted_sample(rng, population, cum_weights, size):
+    """До size разных элементов population с весами cum_weights."""
+    size = min(size, len(population))
+    chosen = {}
+    for _ in range(size * 4):
+        if len(chosen) == size:
+            break
+        item = rng.choices(population, cum_weights=cum_weights)[0]
+        chosen[item] = None
+    return list(chosen)
+
+
+def placeholder_image(seed):
+    image = Image.new('RGB', (480, 320))
+    image.putdata([
+        ((x + seed) % 256, (y * 2) % 256, (x + y) % 256)
+        for y in range(320) for x in range(480)
+    ])
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='seed.png')
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a deterministic synthetic dataset: users, recipes, '
+        'favorites, shopping carts and subscriptions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--favorites-per-user', type=int, default=10)
+        parser.add_argument('--carts-per-user', type=int, default=3)
+        parser.add_argument('--subscriptions-per-user', type=int, default=5)
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Favorites and carts are spread over this many past days',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument(
+            '--password',
+            default='foodgram-seed',
+            help='Password of every generated user',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'seed{options["seed"]}'
+        users = User.objects.filter(username__startswith=f'{self.prefix}-')
+        if users.exists():
+            raise CommandError(
+                f'Данные с seed={options["seed"]} уже созданы, '
+                'укажите другой --seed'
+            )
+        with transaction.atomic():
+            tag_ids = self.ensure_tags()
+            ingredient_ids = self.ensure_ingredients()
+            users = self.create_users(options)
+            self.create_recipes(users, tag_ids, ingredient_ids, options)
+        renormalize(rebuild=True)
+        bump_version(RECIPES_VERSION, REFERENCE_VERSION)
+        tag_registry.invalidate()
+        ingredient_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {options["recipes"]} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def bulk_create(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def added_at(self, now, days):
+        return now - timedelta(seconds=self.rng.random() * days * 86400)
+
+    def ensure_tags(self):
+        used_colors = set(Tag.objects.values_list('color', flat=True))
+        for name, slug, color in TAGS:
+            if color in used_colors:
+                color = f'#{zlib.crc32(slug.encode()) & 0xFFFFFF:06X}'
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def ensure_ingredients(self, minimum=200):
+        if Ingredient.objects.count() < minimum:
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(
+                        name=f'ингредиент {number}',
+                        measurement_unit=UNITS[number % len(UNITS)]
+                    ) for number in range(minimum)
+                ),
+                batch_size=self.batch_size,
+                ignore_conflicts=True
+            )
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        self.rng.shuffle(ingredient_ids)
+        return ingredient_ids
+
+    def create_users(self, options):
+        password = make_password(options['password'])
+        self.bulk_create(User, (
+            User(
+                username=f'{self.prefix}-{number}',
+                email=f'{self.prefix}-{number}@example.com',
+                first_name=f'Имя{number}',
+                last_name=f'Фамилия{number}',
+                password=password,
+            ) for number in range(options['users'])
+        ))
+        users = list(User.objects.filter(
+            username__startswith=f'{self.prefix}-'
+        ).only('id'))
+        self.rng.shuffle(users)
+        return users
+
+    def create_recipes(self, users, tag_ids, ingredient_ids, options):
+        rng = self.rng
+        image = Recipe._meta.get_field('image').storage.save(
+            'recipes/images/seed.png', placeholder_image(options['seed'])
+        )
+        author_weights = zipf_weights(len(users))
+        ingredient_weights = zipf_weights(len(ingredient_ids))
+        tag_weights = zipf_weights(len(tag_ids), 0.7)
+        plans = []
+        for number in range(options['recipes']):
+            author = rng.choices(users, cum_weights=author_weights)[0]
+            plans.append((
+                author.id,
+                {
+                    ingredient_id: rng.choice(AMOUNTS)
+                    for ingredient_id in weighted_sample(
+                        rng, ingredient_ids, ingredient_weights,
+                        rng.randint(3, 12)
+                    )
+                },
+                weighted_sample(rng, tag_ids, tag_weights, rng.randint(1, 3)),
+            ))
+        order = list(range(len(plans)))
+        rng.shuffle(order)
+        recipe_weights = zipf_weights(len(order))
+        relations = {}
+        for name, per_user in (
+            ('favorites', options['favorites_per_user']),
+            ('carts', options['carts_per_user']),
+        ):
+            relations[name] = [
+                (user.id, number) for user in users
+                for number in weighted_sample(
+                    rng, order, recipe_weights,
+                    rng.randint(0, 2 * per_user)
+                )
+            ]
+        subscriptions = [
+            (user.id, author.id) for user in users
+            for author in weighted_sample(
+                rng, users, author_weights,
+                rng.randint(0, 2 * options['subscriptions_per_user'])
+            ) if author.id != user.id
+        ]
+
+        favorites_count = Counter(
+            number for _, number in relations['favorites']
+        )
+        carts_count = Counter(number for _, number in relations['carts'])
+        recipes_count = Counter(author_id for author_id, _, _ in plans)
+        followers_count = Counter(author_id for _, author_id in subscriptions)
+        User.objects.bulk_update(
+            [
+                User(
+                    id=user.id,
+                    recipes_count=recipes_count[user.id],
+                    followers_count=followers_count[user.id],
+                ) for user in users
+            ],
+            ('recipes_count', 'followers_count'),
+            batch_size=self.batch_size
+        )
+        recipes = self.bulk_create(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=f'{DISHES[number % len(DISHES)]} №{number}',
+                text='Сгенерированный рецепт.',
+                cooking_time=rng.randint(5, 180),
+                image=image,
+                tags_mask=Recipe.get_tags_mask(tags),
+                favorites_count=favorites_count[number],
+                shopping_cart_count=carts_count[number],
+            ) for number, (author_id, _, tags) in enumerate(plans)
+        ))
+        if recipes and recipes[0].pk is None:
+            ids = dict(Recipe.objects.filter(
+                author_id__in=[user.id for user in users]
+            ).values_list('name', 'id'))
+            for recipe in recipes:
+                recipe.pk = ids[recipe.name]
+        recipe_ids = [recipe.pk for recipe in recipes]
+
+        self.bulk_create(IngredientInRecipe, (
+            IngredientInRecipe(
+                recipe_id=recipe_ids[number],
+                ingredient_id=ingredient_id,
+                amount=amount
+            ) for number, (_, amounts, _) in enumerate(plans)
+            for ingredient_id, amount in amounts.items()
+        ))
+        update_search_index(recipe_ids)
+        self.bulk_create(TagInRecipe, (
+            TagInRecipe(recipe_id=recipe_ids[number], tag_id=tag_id)
+            for number, (_, _, tags) in enumerate(plans) for tag_id in tags
+        ))
+        # Даты выбираются последними, чтобы остальные данные для
+        # того же --seed не менялись.
+        now = timezone.now()
+        self.bulk_create(Favorite, (
+            Favorite(
+                user_id=user_id,
+                recipe_id=recipe_ids[number],
+                created_at=self.added_at(now, options['days'])
+            ) for user_id, number in relations['favorites']
+        ))
+        self.bulk_create(ShoppingCart, (
+            ShoppingCart(
+                user_id=user_id,
+                recipe_id=recipe_ids[number],
+                created_at=self.added_at(now, options['days'])
+            ) for user_id, number in relations['carts']
+        ))
+        self.bulk_create(Subscribe, (
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id, author_id in subscriptions
+        ))
+        totals = defaultdict(int)
+        for user_id, number in relations['carts']:
+            for ingredient_id, amount in plans[number][1].items():
+                totals[user_id, ingredient_id] += amount
+        self.bulk_create(ShoppingListItem, (
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            ) for (user_id, ingredient_id), amount in totals.items()
+        ))
@@ -1,6 +1,50 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class RecipePagination(CustomPagination):
+    """Постраничная пагинация с необязательным режимом курсора.
+
+    Если в запросе есть параметр cursor (в том числе пустой — первая
+    страница), выдача идёт по ключу -id без COUNT(*) и OFFSET,
+    с непрозрачными ссылками next/previous. С параметрами, которые
+    задают свой порядок (ranked_query_params: популярность, релевантность
+    поиска), курсор не используется: выдача в нём шла бы по -id,
+    а ключ по счёту был бы нестабилен между запросами.
+    """
+
+    cursor_pagination_class = RecipeCursorPagination
+    ranked_query_params = ('ordering', 'search')
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_paginator = self.cursor_pagination_class()
+        if (
+            cursor_paginator.cursor_query_param in request.query_params
+            and not any(
+                param in request.query_params
+                for param in self.ranked_query_params
+            )
+        ):
+            self.cursor_paginator = cursor_paginator
+            return cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,175 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.cache import cache
+
+from recipes.models import IngredientInRecipe
+
+from .cache import ProcessCache
+
+SEQUENCE_KEY = 'foodgram:pantry:sequence'
+CHANGE_KEY = 'foodgram:pantry:change:{}'
+# Сколько изменений процесс догоняет по журналу; при большем отставании
+# или потерянной записи журнала индекс строится заново.
+MAX_REPLAY = 500
+CHANGE_TIMEOUT = 24 * 60 * 60
+MAX_PANTRY_SIZE = 100
+DEFAULT_MAX_MISSING = 3
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class Snapshot:
+    """Неизменяемое состояние индекса: читатели берут его целиком."""
+
+    def __init__(self, postings, recipe_ids, sizes):
+        self.postings = postings
+        self.recipe_ids = recipe_ids
+        self.sizes = sizes
+
+
+class PantryIndex(ProcessCache):
+    """Обратный индекс ингредиент -> отсортированный массив id рецептов.
+
+    Строится из IngredientInRecipe в памяти процесса. Изменённые рецепты
+    записываются в журнал в общем кэше (changed); другие процессы при
+    обращении перечитывают из БД только их и обновляют свои массивы.
+    Раз в REFERENCE_CACHE_TTL секунд индекс строится заново.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._snapshot = Snapshot({}, EMPTY, EMPTY)
+        # Ингредиенты рецептов; меняются только под блокировкой.
+        self._ingredients = {}
+
+    def refresh(self):
+        sequence = cache.get_or_set(SEQUENCE_KEY, 0, None)
+        if self.is_fresh(sequence):
+            return
+        with self._lock:
+            if self.is_fresh(sequence):
+                return
+            if not self.replay(sequence):
+                self.build()
+                self._built_at = time.monotonic()
+            self._version = sequence
+
+    def build(self):
+        pairs = IngredientInRecipe.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id'
+        ).distinct()
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in pairs.iterator():
+            ingredients[recipe_id].add(ingredient_id)
+        postings = defaultdict(list)
+        for recipe_id, ingredient_ids in ingredients.items():
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(recipe_id)
+        recipe_ids = sorted(ingredients)
+        self._ingredients = dict(ingredients)
+        self._snapshot = Snapshot(
+            {
+                ingredient_id: np.array(sorted(ids), dtype=np.int64)
+                for ingredient_id, ids in postings.items()
+            },
+            np.array(recipe_ids, dtype=np.int64),
+            np.array(
+                [len(ingredients[pk]) for pk in recipe_ids], dtype=np.int64
+            ),
+        )
+
+    def replay(self, sequence):
+        """Догоняет журнал изменений с текущей версии до sequence."""
+        if (
+            self._version is None or sequence is None
+            or not 0 < sequence - self._version <= MAX_REPLAY
+        ):
+            return False
+        keys = [
+            CHANGE_KEY.format(number)
+            for number in range(self._version + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        self.apply(set(changes.values()))
+        return True
+
+    def apply(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов recipe_ids и правит массивы."""
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        snapshot = self._snapshot
+        postings = dict(snapshot.postings)
+        ingredients = self._ingredients
+        for recipe_id in recipe_ids:
+            old = ingredients.pop(recipe_id, set())
+            new = current.get(recipe_id, set())
+            if new:
+                ingredients[recipe_id] = new
+            for ingredient_id in old - new:
+                ids = postings[ingredient_id]
+                ids = np.delete(ids, np.searchsorted(ids, recipe_id))
+                if len(ids):
+                    postings[ingredient_id] = ids
+                else:
+                    del postings[ingredient_id]
+            for ingredient_id in new - old:
+                ids = postings.get(ingredient_id, EMPTY)
+                postings[ingredient_id] = np.insert(
+                    ids, np.searchsorted(ids, recipe_id), recipe_id
+                )
+        kept = ~np.isin(snapshot.recipe_ids, list(recipe_ids))
+        current = sorted(current)
+        recipe_ids = np.concatenate((
+            snapshot.recipe_ids[kept], np.array(current, dtype=np.int64)
+        ))
+        sizes = np.concatenate((
+            snapshot.sizes[kept],
+            np.array([len(ingredients[pk]) for pk in current], dtype=np.int64)
+        ))
+        order = np.argsort(recipe_ids, kind='stable')
+        self._snapshot = Snapshot(postings, recipe_ids[order], sizes[order])
+
+    def changed(self, recipe_id):
+        """Записывает изменение рецепта в журнал для всех процессов."""
+        cache.add(SEQUENCE_KEY, 0, None)
+        sequence = cache.incr(SEQUENCE_KEY)
+        cache.set(CHANGE_KEY.format(sequence), recipe_id, CHANGE_TIMEOUT)
+
+    def match(self, ingredient_ids, max_missing):
+        """Рецепты, которым не хватает не больше max_missing ингредиентов.
+
+        Возвращает массивы id рецептов, доли имеющихся ингредиентов
+        и числа недостающих, упорядоченные по убыванию доли, затем по
+        числу недостающих и от новых рецептов к старым.
+        """
+        self.refresh()
+        snapshot = self._snapshot
+        lists = [
+            snapshot.postings[pk] for pk in set(ingredient_ids)
+            if pk in snapshot.postings
+        ]
+        if not lists:
+            return EMPTY, np.empty(0), EMPTY
+        candidates, have = np.unique(
+            np.concatenate(lists), return_counts=True
+        )
+        sizes = snapshot.sizes[
+            np.searchsorted(snapshot.recipe_ids, candidates)
+        ]
+        missing = sizes - have
+        found = missing <= max_missing
+        candidates, have, sizes, missing = (
+            candidates[found], have[found], sizes[found], missing[found]
+        )
+        coverage = have / sizes
+        order = np.lexsort((-candidates, missing, -coverage))
+        return candidates[order], coverage[order], missing[order]
+
+
+pantry_index = PantryIndex()
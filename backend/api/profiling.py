@@ -0,0 +1,182 @@
+import cProfile
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+_timings = ContextVar('request_timings', default=None)
+
+# Не чаще одного дампа по порогу на маршрут за это число секунд.
+THRESHOLD_COOLDOWN = 60
+
+
+class Timings:
+    """Замеры одного запроса: SQL, view, сериализаторы, рендеринг."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.depth = defaultdict(int)
+        self.queries = 0
+        self.route = None
+        self.profiler = None
+        self.view_started = None
+        self.view_finished = None
+        self.render_finished = None
+
+    @contextmanager
+    def section(self, name):
+        """Учитывает только внешний вызов, вложенные не суммируются."""
+        self.depth[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.depth[name] -= 1
+            if not self.depth[name]:
+                self.durations[name] += time.perf_counter() - started
+
+    def execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        with self.section('db'):
+            return execute(sql, params, many, context)
+
+    def rendered(self, response):
+        self.render_finished = time.perf_counter()
+
+    def header(self, total):
+        finished = self.view_finished or time.perf_counter()
+        if self.view_started is not None:
+            self.durations['view'] = finished - self.view_started
+        if self.render_finished is not None:
+            self.durations['render'] = self.render_finished - finished
+        self.durations['total'] = total
+        metrics = [
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in self.durations.items()
+        ]
+        metrics.append(f'queries;desc="{self.queries}"')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def section(name):
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    with timings.section(name):
+        yield
+
+
+def timed(name, function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with section(name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+_installed = False
+
+
+def install():
+    """Оборачивает валидацию и сериализацию DRF замерами времени.
+
+    validate включает декодирование Base64ImageField, serialize —
+    построение данных ответа до рендеринга.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    BaseSerializer.is_valid = timed('validate', BaseSerializer.is_valid)
+    ListSerializer.is_valid = timed('validate', ListSerializer.is_valid)
+    BaseSerializer.data = property(
+        timed('serialize', BaseSerializer.data.fget)
+    )
+
+
+class ProfilingMiddleware:
+    """Заголовок Server-Timing и выборочные дампы cProfile.
+
+    Включается настройкой PROFILING_ENABLED. Профилируется доля
+    PROFILING_SAMPLE_RATE запросов; если запрос медленнее
+    PROFILING_THRESHOLD_MS, профилируется следующий запрос того же
+    маршрута (не чаще раза в THRESHOLD_COOLDOWN секунд). Дампы pstats
+    пишутся в PROFILING_DIR с именем маршрута.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        self.pending = set()
+        self.last_dumps = {}
+
+    def __call__(self, request):
+        timings = Timings()
+        token = _timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            if timings.profiler is not None:
+                timings.profiler.disable()
+            _timings.reset(token)
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.header(total)
+        threshold = settings.PROFILING_THRESHOLD_MS
+        if timings.profiler is not None:
+            self.dump(timings, total)
+        elif (
+            threshold and timings.route and total * 1000 > threshold
+            and time.monotonic() - self.last_dumps.get(timings.route, 0)
+            > THRESHOLD_COOLDOWN
+        ):
+            self.pending.add(timings.route)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _timings.get()
+        if timings is None:
+            return None
+        timings.route = request.resolver_match.view_name
+        timings.view_started = time.perf_counter()
+        if (
+            timings.route in self.pending
+            or random.random() < settings.PROFILING_SAMPLE_RATE
+        ):
+            self.pending.discard(timings.route)
+            timings.profiler = cProfile.Profile()
+            timings.profiler.enable()
+        return None
+
+    def process_template_response(self, request, response):
+        timings = _timings.get()
+        if timings is not None:
+            timings.view_finished = time.perf_counter()
+            response.add_post_render_callback(timings.rendered)
+        return response
+
+    def dump(self, timings, total):
+        self.last_dumps[timings.route] = time.monotonic()
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        route = (timings.route or 'unknown').replace(':', '.')
+        timings.profiler.dump_stats(os.path.join(
+            settings.PROFILING_DIR,
+            f'{route}-{time.time_ns()}-{total * 1000:.0f}ms.prof'
+        ))
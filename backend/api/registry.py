@@ -0,0 +1,59 @@
+import hashlib
+
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Tag
+
+from .cache import ProcessCache
+
+TAGS_VERSION = 'tags'
+
+
+class TagRegistry(ProcessCache):
+    """Справочник тегов в памяти процесса.
+
+    Отвечает на запросы slug -> id и id -> Tag для представлений,
+    фильтров и сериализаторов и хранит готовый JSON ответа /api/tags/.
+    """
+
+    version_name = TAGS_VERSION
+
+    def __init__(self):
+        super().__init__()
+        self._by_id = {}
+        self._by_slug = {}
+        self.content = b'[]'
+        self.etag = '""'
+
+    def build(self):
+        from .serializers import TagSerializer
+
+        tags = list(Tag.objects.order_by('id'))
+        content = JSONRenderer().render(
+            TagSerializer(tags, many=True).data
+        )
+        self._by_id = {tag.id: tag for tag in tags}
+        self._by_slug = {tag.slug: tag for tag in tags}
+        self.content = content
+        self.etag = f'"{hashlib.md5(content).hexdigest()}"'
+
+    def get(self, pk):
+        self.refresh()
+        return self._by_id.get(pk)
+
+    def get_rendered(self):
+        self.refresh()
+        return self.content, self.etag
+
+    def ids_for_slugs(self, slugs):
+        self.refresh()
+        return [
+            self._by_slug[slug].id for slug in slugs if slug in self._by_slug
+        ]
+
+    def slug_choices(self):
+        self.refresh()
+        return [(slug, slug) for slug in self._by_slug]
+
+
+tag_registry = TagRegistry()
@@ -0,0 +1,102 @@
+import re
+from bisect import bisect_left, bisect_right
+
+from recipes.models import Ingredient
+
+from .cache import ProcessCache
+
+INGREDIENTS_VERSION = 'ingredients'
+WORD_START = re.compile(r'\b\w')
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex(ProcessCache):
+    """Поисковый индекс ингредиентов в памяти процесса.
+
+    Строится один раз из таблицы Ingredient и перестраивается при смене
+    версии INGREDIENTS_VERSION. Результаты ранжируются: сначала названия,
+    начинающиеся с запроса, затем названия, в которых с запроса
+    начинается одно из слов, затем прочие вхождения подстроки.
+    """
+
+    version_name = INGREDIENTS_VERSION
+
+    def __init__(self):
+        super().__init__()
+        self._items = []
+        self._keys = []
+        self._words = []
+        self._word_owners = []
+        self._haystack = ''
+        self._offsets = []
+
+    def build(self):
+        items = list(
+            Ingredient.objects.order_by('name', 'id').values(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        items.sort(key=lambda item: (normalize(item['name']), item['id']))
+        keys = [normalize(item['name']) for item in items]
+        words = []
+        for position, key in enumerate(keys):
+            words.extend(
+                (key[match.start():], position)
+                for match in WORD_START.finditer(key) if match.start()
+            )
+        words.sort()
+        offsets = []
+        offset = 0
+        for key in keys:
+            offsets.append(offset)
+            offset += len(key) + 1
+        self._items = items
+        self._keys = keys
+        self._words = [word for word, _ in words]
+        self._word_owners = [position for _, position in words]
+        self._haystack = '\n'.join(keys)
+        self._offsets = offsets
+
+    @staticmethod
+    def _prefix_range(keys, prefix):
+        start = bisect_left(keys, prefix)
+        end = bisect_right(keys, prefix + '\uffff', lo=start)
+        return range(start, end)
+
+    def _substring_positions(self, query):
+        offsets = self._offsets
+        start = self._haystack.find(query)
+        while start != -1:
+            position = bisect_right(offsets, start) - 1
+            yield position
+            if position + 1 == len(offsets):
+                return
+            start = self._haystack.find(query, offsets[position + 1])
+
+    def search(self, query=''):
+        self.refresh()
+        items = self._items
+        query = normalize(query)
+        if not query:
+            return list(items)
+        if '\n' in query:
+            return []
+        positions = list(self._prefix_range(self._keys, query))
+        seen = set(positions)
+        word_hits = sorted({
+            self._word_owners[index]
+            for index in self._prefix_range(self._words, query)
+        } - seen)
+        seen.update(word_hits)
+        positions.extend(word_hits)
+        positions.extend(
+            position for position in self._substring_positions(query)
+            if position not in seen
+        )
+        return [items[position] for position in positions]
+
+
+ingredient_index = IngredientIndex()
@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ErrorDetail, ValidationError
 
 from recipes.constant import (
     MIN_INGREDIENT_AMOUNT,
@@ -13,9 +17,13 @@ from recipes.models import (
     Ingredient,
     IngredientInRecipe,
     Recipe,
+    ShoppingListItem,
     Tag,
     TagInRecipe)
 
+from .pantry import DEFAULT_MAX_MISSING, MAX_PANTRY_SIZE
+from .registry import tag_registry
+
 
 User = get_user_model()
 
@@ -42,6 +50,9 @@ class ProfileSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context['request']
         user = getattr(request, 'user', None)
         if user and not user.is_anonymous:
@@ -78,6 +89,50 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+class ThumbnailsField(serializers.Field):
+    """Превью картинки рецепта: srcset в JPEG и WebP по ширинам.
+
+    Пока превью не построены, srcset указывает на оригинал.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        if not recipe.thumbnails_ready:
+            return {
+                'srcset': self.get_url(recipe.image.name),
+                'webp_srcset': None,
+                'sizes': {},
+            }
+        sizes = {
+            width: {
+                image_format: self.get_url(name)
+                for image_format, name in variants.items()
+            } for width, variants in recipe.thumbnails['sizes'].items()
+        }
+        return {
+            'srcset': ', '.join(
+                f'{urls["jpeg"]} {width}w' for width, urls in sizes.items()
+            ),
+            'webp_srcset': ', '.join(
+                f'{urls["webp"]} {width}w' for width, urls in sizes.items()
+            ),
+            'sizes': sizes,
+        }
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения рецепта."""
 
@@ -88,31 +143,63 @@ class RecipeListSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    thumbnails = ThumbnailsField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'thumbnails', 'text',
+            'cooking_time',
         )
 
+    def to_representation(self, instance):
+        is_subscribed = getattr(instance, 'is_author_subscribed', None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.favorites.filter(user=user).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.shopping_cart.filter(user=user).exists()
         return False
 
 
+class PrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """Поле первичного ключа, которое проверяет только тип значения.
+
+    Объекты по таким ключам разрешаются позже, пачкой.
+    """
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_value(self, data):
+        return self.to_pk(data)
+
+
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления ингредиентов."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = PrimaryKeyField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         min_value=MIN_INGREDIENT_AMOUNT,
         max_value=MAX_INGREDIENT_AMOUNT
@@ -123,13 +210,23 @@ class AddIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class TagPrimaryKeyField(PrimaryKeyField):
+    """Поле тега, которое ищет теги в справочнике процесса, а не в БД."""
+
+    def to_internal_value(self, data):
+        tag = tag_registry.get(self.to_pk(data))
+        if tag is None:
+            self.fail('does_not_exist', pk_value=data)
+        return tag
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания рецепта."""
 
     author = ProfileSerializer(read_only=True)
     image = Base64ImageField()
     ingredients = AddIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = TagPrimaryKeyField(
         queryset=Tag.objects.all(),
         many=True
     )
@@ -150,6 +247,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'ingredients': 'Нужно выбрать хотя бы один ингредиент!'}
             )
+        ingredients = self.resolve_ingredients(ingredients)
         unique_ingredient_id = set()
         for ingredient in ingredients:
             ingredient_id = ingredient['id']
@@ -160,6 +258,31 @@ class RecipeSerializer(serializers.ModelSerializer):
             unique_ingredient_id.add(ingredient_id)
         return ingredients
 
+    def resolve_ingredients(self, ingredients):
+        """Заменяет id ингредиентов объектами одним запросом IN.
+
+        Ошибки для отсутствующих id возвращаются по позициям списка
+        в том же формате и с тем же кодом, что и у PrimaryKeyRelatedField.
+        """
+        found = Ingredient.objects.in_bulk(
+            {ingredient['id'] for ingredient in ingredients}
+        )
+        message = PrimaryKeyField.default_error_messages['does_not_exist']
+        errors = [
+            {} if ingredient['id'] in found
+            else {'id': [ErrorDetail(
+                message.format(pk_value=ingredient['id']),
+                code='does_not_exist'
+            )]}
+            for ingredient in ingredients
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [
+            {**ingredient, 'id': found[ingredient['id']]}
+            for ingredient in ingredients
+        ]
+
     def validate_tags(self, tags):
         if not tags:
             raise serializers.ValidationError(
@@ -201,24 +324,127 @@ class RecipeSerializer(serializers.ModelSerializer):
         ]
         TagInRecipe.objects.bulk_create(tags_list)
 
+    @staticmethod
+    def sync_ingredients(ingredients, recipe):
+        """Приводит ингредиенты рецепта к списку ingredients.
+
+        Удаляются только исчезнувшие ингредиенты, изменённые количества
+        обновляются на месте, добавляются только новые ингредиенты.
+        Возвращает прежние и новые количества {ingredient_id: amount}.
+        """
+        existing = {
+            item.ingredient_id: item
+            for item in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: item.amount or 0
+            for ingredient_id, item in existing.items()
+        }
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = [
+            item.pk for ingredient_id, item in existing.items()
+            if ingredient_id not in new_amounts
+        ]
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            item = existing.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            IngredientInRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'].id not in existing
+        ]
+        if added:
+            RecipeSerializer.create_ingredients(added, recipe)
+        return old_amounts, new_amounts
+
+    @staticmethod
+    def sync_tags(tags, recipe):
+        """Приводит теги рецепта к списку tags, не трогая оставшиеся."""
+        existing = set(
+            TagInRecipe.objects.filter(recipe=recipe).values_list(
+                'tag_id', flat=True
+            )
+        )
+        new_ids = {tag.id for tag in tags}
+        removed = existing - new_ids
+        if removed:
+            TagInRecipe.objects.filter(
+                recipe=recipe, tag_id__in=removed
+            ).delete()
+        added = [tag for tag in tags if tag.id not in existing]
+        if added:
+            RecipeSerializer.create_tags(added, recipe)
+        return bool(removed or added)
+
+    @staticmethod
+    def is_same_image(recipe, image):
+        """Совпадает ли загруженная картинка с картинкой рецепта.
+
+        Имя файла в хранилище картинок строится из хеша содержимого,
+        поэтому те же байты дают то же имя и сравнивать файлы не нужно.
+        """
+        field = recipe.image.field
+        name = field.generate_filename(recipe, image.name)
+        return recipe.image.name == field.storage.content_name(name, image)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            tags_mask=Recipe.get_tags_mask(tag.id for tag in tags),
+            **validated_data
+        )
         self.create_ingredients(ingredients, recipe)
         self.create_tags(tags, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
-        instance.tags.clear()
-        self.create_tags(tags, instance)
-        return super().update(instance, validated_data)
+        old_amounts, new_amounts = self.sync_ingredients(
+            ingredients, instance
+        )
+        ShoppingListItem.objects.change_recipe(
+            instance, old_amounts, new_amounts
+        )
+        tags_changed = self.sync_tags(tags, instance)
+        instance.tags_mask = Recipe.get_tags_mask(tag.id for tag in tags)
+        image = validated_data.get('image')
+        if image is not None and self.is_same_image(instance, image):
+            del validated_data['image']
+        changed_fields = [
+            attr for attr, value in validated_data.items()
+            if getattr(instance, attr) != value
+        ]
+        for attr in changed_fields:
+            setattr(instance, attr, validated_data[attr])
+        if changed_fields or tags_changed or old_amounts != new_amounts:
+            instance.save()
+        return instance
 
     def to_representation(self, instance):
+        instance._prefetched_objects_cache = {}
+        prefetch_related_objects(
+            (instance,),
+            Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+            'tags'
+        )
         return RecipeListSerializer(
             instance, context={'request': self.context.get('request')}
         ).data
@@ -227,15 +453,52 @@ class RecipeSerializer(serializers.ModelSerializer):
 class SubscribeRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения информации рецептов."""
 
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=MAX_PANTRY_SIZE
+    )
+    max_missing = serializers.IntegerField(
+        min_value=0, default=DEFAULT_MAX_MISSING
+    )
+
+
+class SimilarQuerySerializer(serializers.Serializer):
+    """Параметры выдачи похожих рецептов."""
+
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.SIMILAR_RECIPES_COUNT,
+        default=settings.SIMILAR_RECIPES_COUNT
+    )
+
+
+class PantryRecipeSerializer(SubscribeRecipeSerializer):
+    """Рецепт с долей имеющихся и списком недостающих ингредиентов."""
+
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(SubscribeRecipeSerializer.Meta):
+        fields = SubscribeRecipeSerializer.Meta.fields + (
+            'coverage', 'missing_ingredients'
+        )
 
 
 class SubscribeListSerializer(ProfileSerializer):
     """Сериализатор для отображения подписок пользователя."""
 
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     recipes = serializers.SerializerMethodField()
 
     class Meta(ProfileSerializer.Meta):
@@ -259,6 +522,11 @@ class SubscribeListSerializer(ProfileSerializer):
         return data
 
     def get_recipes(self, obj):
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is not None:
+            return SubscribeRecipeSerializer(
+                recipes, many=True, read_only=True
+            ).data
         request = self.context.get('request')
         limit = request.GET.get('recipes_limit')
         recipes = obj.recipes.all()
@@ -268,6 +536,3 @@ class SubscribeListSerializer(ProfileSerializer):
             recipes, many=True, read_only=True
         )
         return serializer.data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
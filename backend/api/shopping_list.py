@@ -0,0 +1,65 @@
+import csv
+import json
+
+SHOPPING_LIST_TITLE = 'Cписок покупок:'
+SHOPPING_LIST_FILENAME = 'shopping_list'
+CSV_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+CURSOR_CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+
+class Echo:
+    """Файлоподобный объект, который возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def buffered(parts, size=BUFFER_SIZE):
+    """Склеивает мелкие фрагменты в куски примерно по size символов."""
+    buffer = []
+    length = 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_txt(ingredients):
+    yield SHOPPING_LIST_TITLE
+    for ingredient in ingredients:
+        yield (
+            f'\n{ingredient["name"]} - {ingredient["amount"]} '
+            f'{ingredient["measurement_unit"]}'
+        )
+
+
+def export_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['amount'],
+            ingredient['measurement_unit']
+        ))
+
+
+def export_json(ingredients):
+    separator = '['
+    for ingredient in ingredients:
+        yield separator + json.dumps(ingredient, ensure_ascii=False)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+EXPORTERS = {
+    'txt': (export_txt, 'text/plain; charset=utf-8'),
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'json': (export_json, 'application/json'),
+}
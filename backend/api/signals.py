@@ -0,0 +1,113 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe, Tag,
+                            TagInRecipe)
+
+from .authentication import token_cache
+from .cache import (RECIPES_VERSION, REFERENCE_VERSION, author_version,
+                    bump_version, recipe_version)
+from .pantry import pantry_index
+from .registry import TAGS_VERSION
+from .search import INGREDIENTS_VERSION
+
+User = get_user_model()
+
+# Поля автора, которые попадают в ответы с рецептами (id не меняется).
+AUTHOR_FIELDS = frozenset({'email', 'username', 'first_name', 'last_name'})
+
+
+def bump_on_commit(*names):
+    # Версии меняются только после фиксации: иначе параллельный запрос
+    # успел бы построить кэш процесса из старых строк и хранить его до
+    # REFERENCE_CACHE_TTL.
+    transaction.on_commit(lambda: bump_version(*names))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    bump_on_commit(INGREDIENTS_VERSION, REFERENCE_VERSION)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_on_commit(TAGS_VERSION, REFERENCE_VERSION)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    bump_on_commit(RECIPES_VERSION, recipe_version(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_pantry_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= Recipe.DERIVED_FIELDS:
+        return
+    # После удаления pk экземпляра уже равен None.
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: pantry_index.changed(recipe_id))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def update_pantry_index_for_ingredient(sender, instance, **kwargs):
+    recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+
+    def record():
+        for recipe_id in recipe_ids:
+            pantry_index.changed(recipe_id)
+
+    transaction.on_commit(record)
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+@receiver((post_save, post_delete), sender=TagInRecipe)
+def invalidate_recipe_relations(sender, instance, **kwargs):
+    bump_on_commit(RECIPES_VERSION, recipe_version(instance.recipe_id))
+
+
+@receiver(pre_save, sender=User)
+def check_author_fields(sender, instance, update_fields=None, **kwargs):
+    fields = AUTHOR_FIELDS
+    if update_fields is not None:
+        fields = fields & set(update_fields)
+    instance._author_changed = False
+    if instance._state.adding or not fields:
+        return
+    saved = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._author_changed = saved is None or any(
+        saved[field] != getattr(instance, field) for field in fields
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, created, **kwargs):
+    # Новый пользователь ещё не автор, а смена пароля или входа
+    # не меняет ответов с рецептами.
+    if created or not getattr(instance, '_author_changed', True):
+        return
+    bump_on_commit(RECIPES_VERSION, author_version(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_author(sender, instance, **kwargs):
+    bump_on_commit(RECIPES_VERSION, author_version(instance.pk))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None,
+                           **kwargs):
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(lambda: token_cache.invalidate_user(instance.pk))
@@ -0,0 +1,808 @@
+import base64
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.cache import (RECIPES_VERSION, REFERENCE_VERSION, RESPONSE_KEY,
+                       author_version, bump_version, get_version,
+                       recipe_version, response_timeout)
+from recipes.constant import TAGS_MASK_BITS
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, SimilarRecipe,
+                            Tag, TagInRecipe, User)
+from recipes.search import update_search_index
+from recipes.similarity import update_similar_recipes
+from recipes.trending import TRENDING_WEIGHTS, change_trending
+from users.models import Subscribe
+
+SHARED_CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'foodgram'),
+}}
+
+# (название, путь, от имени пользователя, бюджет запросов)
+ROUTES = (
+    ('ingredients: search', '/api/ingredients/?name=budget', False, 0),
+    ('tags: list', '/api/tags/', False, 0),
+    ('tags: detail', '/api/tags/{tag}/', False, 0),
+    ('recipes: list anonymous', '/api/recipes/', False, 4),
+    ('recipes: list', '/api/recipes/', True, 4),
+    ('recipes: cursor', '/api/recipes/?cursor=', True, 3),
+    ('recipes: tag', '/api/recipes/?tags={tag_slug}', True, 4),
+    (
+        'recipes: tags',
+        '/api/recipes/?tags={tag_slug}&tags={other_tag_slug}', True, 4
+    ),
+    ('recipes: author', '/api/recipes/?author={author}', True, 5),
+    ('recipes: search', '/api/recipes/?search=budget', True, 4),
+    (
+        'recipes: search with tag',
+        '/api/recipes/?search=budget&tags={tag_slug}', True, 4
+    ),
+    ('recipes: trending', '/api/recipes/?ordering=trending', True, 4),
+    ('recipes: favorited', '/api/recipes/?is_favorited=1', True, 4),
+    (
+        'recipes: in shopping cart',
+        '/api/recipes/?is_in_shopping_cart=1', True, 4
+    ),
+    ('recipes: detail anonymous', '/api/recipes/{recipe}/', False, 3),
+    ('recipes: detail', '/api/recipes/{recipe}/', True, 3),
+    ('recipes: similar', '/api/recipes/{recipe}/similar/', False, 1),
+    (
+        'recipes: pantry',
+        '/api/recipes/pantry/?ingredients={ingredient}'
+        '&ingredients={other_ingredient}', False, 2
+    ),
+    (
+        'recipes: shopping list txt',
+        '/api/recipes/download_shopping_cart/', True, 1
+    ),
+    (
+        'recipes: shopping list csv',
+        '/api/recipes/download_shopping_cart/?format=csv', True, 1
+    ),
+    (
+        'recipes: shopping list json',
+        '/api/recipes/download_shopping_cart/?format=json', True, 1
+    ),
+    ('users: list', '/api/users/', True, 2),
+    ('users: detail', '/api/users/{author}/', True, 1),
+    ('users: me', '/api/users/me/', True, 0),
+    ('users: subscriptions', '/api/users/subscriptions/', True, 3),
+    (
+        'users: subscriptions limited',
+        '/api/users/subscriptions/?recipes_limit=2', True, 3
+    ),
+)
+
+
+def seq_scans(plan):
+    """Узлы плана Seq Scan с фильтром — таблица читается без индекса."""
+    if plan.get('Node Type') == 'Seq Scan' and 'Filter' in plan:
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+class RecipeDataMixin:
+    """Пользователь, два автора и по несколько рецептов у каждого."""
+
+    recipes_per_author = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='reader', email='reader@example.com',
+            first_name='reader', last_name='reader',
+        )
+        cls.authors = [
+            User.objects.create(
+                username=f'author-{number}',
+                email=f'author-{number}@example.com',
+                first_name='author', last_name='author',
+            ) for number in range(2)
+        ]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'tag {number}', slug=f'tag-{number}',
+                color=f'#00000{number}',
+            ) for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient {number}', measurement_unit='г'
+            ) for number in range(4)
+        ]
+        cls.recipes = []
+        for author in cls.authors:
+            for number in range(cls.recipes_per_author):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name=f'{author.username} {number}',
+                    text='text',
+                    cooking_time=10,
+                    image='recipes/images/test.png',
+                )
+                IngredientInRecipe.objects.bulk_create(
+                    IngredientInRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    ) for ingredient in cls.ingredients[number % 2:][:3]
+                )
+                TagInRecipe.objects.bulk_create(
+                    TagInRecipe(recipe=recipe, tag=tag)
+                    for tag in cls.tags[number % 3:][:2]
+                )
+                recipe.update_tags_mask()
+                cls.recipes.append(recipe)
+        cls.token = Token.objects.create(user=cls.user).key
+
+    def setUp(self):
+        # Версии и ответы в общем кэше пережили бы откат данных теста.
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+
+class RecipeQueryCountTest(RecipeDataMixin, TestCase):
+    """Число запросов ленты и рецепта не зависит от числа рецептов."""
+
+    def assertQueriesWarm(self, client, path, count):
+        """Первый запрос прогревает кэши процесса и токен."""
+        self.assertEqual(client.get(path).status_code, 200)
+        recipe = self.recipes[0]
+        bump_version(
+            RECIPES_VERSION, REFERENCE_VERSION,
+            recipe_version(recipe.pk), author_version(recipe.author_id),
+        )
+        with self.assertNumQueries(count):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list_anonymous(self):
+        response = self.assertQueriesWarm(self.anonymous, '/api/recipes/', 4)
+        self.assertEqual(response.data['count'], len(self.recipes))
+
+    def test_list_anonymous_cached(self):
+        self.anonymous.get('/api/recipes/')
+        with self.assertNumQueries(0):
+            response = self.anonymous.get('/api/recipes/')
+        self.assertEqual(response.data['count'], len(self.recipes))
+
+    def test_list(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[-1])
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[-1])
+        Subscribe.objects.create(user=self.user, author=self.authors[-1])
+        response = self.assertQueriesWarm(self.client, '/api/recipes/', 4)
+        first = response.data['results'][0]
+        self.assertEqual(first['id'], self.recipes[-1].pk)
+        self.assertTrue(first['is_favorited'])
+        self.assertTrue(first['is_in_shopping_cart'])
+        self.assertTrue(first['author']['is_subscribed'])
+        self.assertFalse(response.data['results'][-1]['is_favorited'])
+
+    def test_list_page_size(self):
+        for limit in (1, len(self.recipes)):
+            with self.subTest(limit=limit):
+                response = self.assertQueriesWarm(
+                    self.client, f'/api/recipes/?limit={limit}', 4
+                )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_cursor(self):
+        self.assertQueriesWarm(self.client, '/api/recipes/?cursor=', 3)
+
+    def test_cursor_with_search(self):
+        # Порядок по релевантности не совместим с ключом курсора.
+        update_search_index(recipe.pk for recipe in self.recipes)
+        response = self.client.get(
+            '/api/recipes/', {'cursor': '', 'search': 'author'}
+        )
+        self.assertEqual(response.data['count'], len(self.recipes))
+
+    def test_detail_anonymous(self):
+        recipe = self.recipes[0]
+        response = self.assertQueriesWarm(
+            self.anonymous, f'/api/recipes/{recipe.pk}/', 3
+        )
+        self.assertEqual(len(response.data['ingredients']), 3)
+        self.assertEqual(len(response.data['tags']), 2)
+
+    def test_detail(self):
+        recipe = self.recipes[0]
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        response = self.assertQueriesWarm(
+            self.client, f'/api/recipes/{recipe.pk}/', 3
+        )
+        self.assertTrue(response.data['is_favorited'])
+        self.assertFalse(response.data['is_in_shopping_cart'])
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов каждого маршрута API не больше его бюджета.
+
+    На PostgreSQL запросы маршрутов ещё и не читают таблицы
+    последовательно с фильтром.
+    """
+
+    recipes_per_author = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            User.objects.create(
+                username=f'budget-{number}',
+                email=f'budget-{number}@example.com',
+                first_name='budget', last_name='budget',
+            ) for number in range(4)
+        ]
+        user, authors = users[0], users[1:]
+        tags = [
+            Tag.objects.create(
+                name=f'budget {number}', slug=f'budget-{number}',
+                color=f'#00000{number}',
+            ) for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'budget {number}', measurement_unit='г'
+            ) for number in range(5)
+        ]
+        recipes = []
+        for author in authors:
+            Subscribe.objects.create(user=user, author=author)
+            for number in range(cls.recipes_per_author):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name=f'{author.username} {number}',
+                    text='budget',
+                    cooking_time=10,
+                    image='recipes/images/budget.png',
+                )
+                IngredientInRecipe.objects.bulk_create(
+                    IngredientInRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=10
+                    ) for ingredient in ingredients[number % 2:][:3]
+                )
+                TagInRecipe.objects.bulk_create(
+                    TagInRecipe(recipe=recipe, tag=tag) for tag in tags
+                )
+                recipe.update_tags_mask()
+                favorite = Favorite.objects.create(user=user, recipe=recipe)
+                change_trending(
+                    recipe.pk, TRENDING_WEIGHTS[Favorite],
+                    favorite.created_at
+                )
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+                recipes.append(recipe)
+        # Индекс и похожие рецепты обновляются после фиксации.
+        update_search_index(recipe.pk for recipe in recipes)
+        update_similar_recipes(recipes[0].pk)
+        cls.token = Token.objects.create(user=user).key
+        cls.dataset = {
+            'author': authors[0].pk,
+            'recipe': recipes[0].pk,
+            'tag': tags[0].pk,
+            'ingredient': ingredients[0].pk,
+            'other_ingredient': ingredients[1].pk,
+            'tag_slug': tags[0].slug,
+            'other_tag_slug': tags[1].slug,
+        }
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def routes(self):
+        for name, path, as_user, budget in ROUTES:
+            yield (
+                name, path.format(**self.dataset),
+                self.client if as_user else self.anonymous, budget
+            )
+
+    def get(self, client, path):
+        response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+
+    def warm_up(self, client, path):
+        client.get(path)
+        # Кэши процесса прогреты, кэш ответов сброшен.
+        bump_version(
+            RECIPES_VERSION, REFERENCE_VERSION,
+            recipe_version(self.dataset['recipe']),
+            author_version(self.dataset['author']),
+        )
+
+    def test_budgets(self):
+        for name, path, client, budget in self.routes():
+            with self.subTest(name):
+                self.warm_up(client, path)
+                with self.assertNumQueries(budget):
+                    self.get(client, path)
+
+    @skipUnless(connection.vendor == 'postgresql', 'нужен EXPLAIN PostgreSQL')
+    def test_no_seq_scans(self):
+        for name, path, client, _ in self.routes():
+            with self.subTest(name):
+                self.warm_up(client, path)
+                with CaptureQueriesContext(connection) as queries:
+                    self.get(client, path)
+                self.assertEqual(self.seq_scans(queries), set())
+
+    @staticmethod
+    def seq_scans(queries):
+        tables = set()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {query["sql"]}')
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                tables.update(seq_scans(plan[0]['Plan']))
+            cursor.execute('SET LOCAL enable_seqscan = on')
+        return tables
+
+
+class TagFilterTest(RecipeDataMixin, TestCase):
+    """Фильтр по тегам: рецепты с любым из тегов, без повторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Тег вне битовой маски фильтруется через EXISTS.
+        cls.wide_tag = Tag.objects.create(
+            id=TAGS_MASK_BITS + 100, name='wide', slug='wide',
+            color='#ffffff',
+        )
+        for recipe in cls.recipes[::3]:
+            TagInRecipe.objects.create(recipe=recipe, tag=cls.wide_tag)
+            recipe.update_tags_mask()
+
+    def expected(self, tags, recipes=None):
+        ids = set(TagInRecipe.objects.filter(tag__in=tags).values_list(
+            'recipe_id', flat=True
+        ))
+        if recipes is not None:
+            ids &= {recipe.pk for recipe in recipes}
+        return sorted(ids, reverse=True)
+
+    def get_ids(self, query, client=None):
+        response = (client or self.client).get(
+            f'/api/recipes/?limit=100&{query}'
+        )
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(response.data['count'], len(ids))
+        return ids
+
+    def test_any_tag_without_duplicates(self):
+        cases = (
+            [self.tags[0]],
+            [self.tags[0], self.tags[1]],
+            self.tags,
+            [self.wide_tag],
+            [self.tags[2], self.wide_tag],
+        )
+        for tags in cases:
+            query = '&'.join(f'tags={tag.slug}' for tag in tags)
+            with self.subTest(query=query):
+                self.assertEqual(self.get_ids(query), self.expected(tags))
+                self.assertEqual(
+                    self.get_ids(query, self.anonymous), self.expected(tags)
+                )
+
+    def test_unknown_tag(self):
+        response = self.client.get('/api/recipes/?tags=missing')
+        self.assertEqual(response.status_code, 400)
+
+    def test_with_author(self):
+        author = self.authors[1]
+        tags = [self.tags[0], self.tags[2]]
+        self.assertEqual(
+            self.get_ids(
+                f'tags={tags[0].slug}&tags={tags[1].slug}&author={author.pk}'
+            ),
+            self.expected(tags, author.recipes.all()),
+        )
+
+    def test_with_favorites_and_shopping_cart(self):
+        favorites = self.recipes[:5]
+        cart = self.recipes[3:]
+        for recipe in favorites:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        for recipe in cart:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        tags = [self.tags[1], self.wide_tag]
+        query = f'tags={tags[0].slug}&tags={tags[1].slug}'
+        self.assertEqual(
+            self.get_ids(f'{query}&is_favorited=1'),
+            self.expected(tags, favorites),
+        )
+        self.assertEqual(
+            self.get_ids(f'{query}&is_in_shopping_cart=1'),
+            self.expected(tags, cart),
+        )
+        self.assertEqual(
+            self.get_ids(f'{query}&is_favorited=1&is_in_shopping_cart=1'),
+            self.expected(tags, set(favorites) & set(cart)),
+        )
+
+    def test_mask_follows_tag_rows(self):
+        recipe = self.recipes[2]
+        relation = TagInRecipe.objects.create(recipe=recipe, tag=self.tags[0])
+        query = f'tags={self.tags[0].slug}'
+        self.assertIn(recipe.pk, self.get_ids(query))
+        relation.delete()
+        self.assertNotIn(recipe.pk, self.get_ids(query))
+
+    def test_reconcile_masks(self):
+        recipe = self.recipes[0]
+        Recipe.objects.filter(pk=recipe.pk).update(tags_mask=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).tags_mask,
+            Recipe.get_tags_mask(
+                recipe.tags.values_list('id', flat=True)
+            ),
+        )
+
+    def test_reads_only_one_page(self):
+        query = f'/api/recipes/?limit=2&tags={self.tags[0].slug}'
+        self.client.get(query)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(query)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(len(queries), 4)
+        table = Recipe._meta.db_table
+        for query in queries:
+            sql = query['sql']
+            if f'FROM "{table}"' not in sql or 'COUNT(' in sql:
+                continue
+            with self.subTest(sql=sql):
+                self.assertIn('LIMIT 2', sql)
+                self.assertNotIn(TagInRecipe._meta.db_table, sql)
+
+
+class RecipeUpdateTest(RecipeDataMixin, TestCase):
+    """Правка рецепта пишет в БД только то, что изменилось."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = cls.recipes[0]
+        content = BytesIO()
+        Image.new('RGB', (1, 1)).save(content, 'PNG')
+        cls.image = 'data:image/png;base64,' + base64.b64encode(
+            content.getvalue()
+        ).decode()
+        # Картинка уже сохранена: в хранилище её имя — хеш содержимого.
+        image_field = Recipe._meta.get_field('image')
+        cls.image_name = image_field.storage.content_name(
+            image_field.generate_filename(cls.recipe, 'image.png'),
+            ContentFile(content.getvalue()),
+        )
+        Recipe.objects.filter(pk=cls.recipe.pk).update(image=cls.image_name)
+        cls.author_token = Token.objects.create(user=cls.recipe.author).key
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient(
+            HTTP_AUTHORIZATION=f'Token {self.author_token}'
+        )
+
+    def payload(self, **changes):
+        recipe = self.recipe
+        payload = {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': self.image,
+            'tags': list(
+                recipe.tags.order_by('id').values_list('id', flat=True)
+            ),
+            'ingredients': [
+                {'id': item.ingredient_id, 'amount': item.amount}
+                for item in recipe.recipe_ingredients.order_by('id')
+            ],
+        }
+        payload.update(changes)
+        return payload
+
+    def patch(self, payload):
+        """Запросы на запись, выполненные при сохранении рецепта."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', payload, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        writes = []
+        for query in queries:
+            verb = query['sql'].split(' ', 1)[0]
+            if verb in ('INSERT', 'UPDATE', 'DELETE'):
+                table = next(
+                    model._meta.db_table for model in (
+                        Recipe, IngredientInRecipe, TagInRecipe
+                    ) if f'"{model._meta.db_table}"' in query['sql']
+                )
+                writes.append((verb, table))
+        return sorted(writes)
+
+    def test_no_changes(self):
+        self.assertEqual(self.patch(self.payload()), [])
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).image.name, self.image_name
+        )
+
+    def test_name(self):
+        self.assertEqual(
+            self.patch(self.payload(name='new name')),
+            [('UPDATE', Recipe._meta.db_table)],
+        )
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).name, 'new name'
+        )
+
+    def test_ingredient_amount(self):
+        payload = self.payload()
+        payload['ingredients'][0]['amount'] += 1
+        self.assertEqual(self.patch(payload), [
+            ('UPDATE', IngredientInRecipe._meta.db_table),
+            ('UPDATE', Recipe._meta.db_table),
+        ])
+
+    def test_ingredient_replaced(self):
+        payload = self.payload()
+        used = {item['id'] for item in payload['ingredients']}
+        payload['ingredients'][-1]['id'] = next(
+            ingredient.pk for ingredient in self.ingredients
+            if ingredient.pk not in used
+        )
+        self.assertEqual(self.patch(payload), [
+            ('DELETE', IngredientInRecipe._meta.db_table),
+            ('INSERT', IngredientInRecipe._meta.db_table),
+            ('UPDATE', Recipe._meta.db_table),
+        ])
+
+    def test_tag_added(self):
+        payload = self.payload()
+        payload['tags'].append(next(
+            tag.pk for tag in self.tags if tag.pk not in payload['tags']
+        ))
+        self.assertEqual(self.patch(payload), [
+            ('INSERT', TagInRecipe._meta.db_table),
+            ('UPDATE', Recipe._meta.db_table),
+        ])
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).tags_mask,
+            Recipe.get_tags_mask(payload['tags']),
+        )
+
+    def test_unknown_ingredient(self):
+        payload = self.payload()
+        missing = max(ingredient.pk for ingredient in self.ingredients) + 1
+        payload['ingredients'].append({'id': missing, 'amount': 1})
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', payload, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        [error] = response.data['ingredients'][-1]['id']
+        self.assertEqual(error.code, 'does_not_exist')
+        self.assertIn(str(missing), error)
+
+
+class AuthorVersionTest(TestCase):
+    """Версия автора меняется только вместе с его полями в ответах."""
+
+    def save(self, user, **kwargs):
+        before = get_version(author_version(user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(**kwargs)
+        return get_version(author_version(user.pk)) != before
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='author', last_name='author',
+        )
+
+    def test_created(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            User.objects.create(
+                username='new', email='new@example.com',
+                first_name='new', last_name='new',
+            )
+        self.assertEqual(callbacks, [])
+
+    def test_password(self):
+        self.author.set_password('password')
+        self.assertFalse(self.save(self.author))
+
+    def test_same_name(self):
+        self.author.first_name = 'author'
+        self.assertFalse(self.save(self.author))
+
+    def test_name(self):
+        self.author.first_name = 'renamed'
+        self.assertTrue(self.save(self.author))
+
+    def test_other_update_fields(self):
+        self.author.first_name = 'renamed'
+        self.assertFalse(self.save(self.author, update_fields=['is_active']))
+
+
+class ShoppingTotalsTest(RecipeDataMixin, TestCase):
+    """rebuild_shopping_totals --check завершается ошибкой при расхождениях."""
+
+    def setUp(self):
+        super().setUp()
+        for recipe in self.recipes[:2]:
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def check(self):
+        call_command('rebuild_shopping_totals', '--check', stdout=StringIO())
+
+    def test_consistent(self):
+        self.check()
+
+    def test_mismatch(self):
+        ShoppingListItem.objects.filter(user=self.user).update(amount=1)
+        with self.assertRaises(CommandError):
+            self.check()
+        call_command('rebuild_shopping_totals', stdout=StringIO())
+        self.check()
+
+    def test_admin(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin',
+            first_name='admin', last_name='admin',
+        )
+        self.client.force_login(admin)
+        url = '/admin/recipes/ingredientinrecipe/{}/{}/'
+        item = IngredientInRecipe.objects.filter(
+            recipe=self.recipes[0]
+        ).first()
+        response = self.client.post(url.format(item.pk, 'change'), {
+            'recipe': self.recipes[1].pk,
+            'ingredient': self.ingredients[0].pk,
+            'amount': 7,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.check()
+        response = self.client.post(
+            url.format(item.pk, 'delete'), {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.check()
+
+
+class TokenCacheTest(TestCase):
+    """Срок токена в CACHES зависит от того, общий ли это кэш."""
+
+    @override_settings(TOKEN_CACHE_TTL=300, TOKEN_CACHE_LOCAL_TTL=5)
+    def test_process_local_cache(self):
+        self.assertEqual(token_cache.shared_ttl(), 5)
+
+    @override_settings(
+        TOKEN_CACHE_TTL=300, TOKEN_CACHE_LOCAL_TTL=5, CACHES=SHARED_CACHES
+    )
+    def test_shared_cache(self):
+        self.assertEqual(token_cache.shared_ttl(), 300)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=300, RESPONSE_CACHE_LOCAL_TIMEOUT=5)
+class ResponseCacheTest(RecipeDataMixin, TestCase):
+    """Кэш ответов в памяти процесса не переживает чужих изменений."""
+
+    def test_process_local_cache(self):
+        self.assertEqual(response_timeout(), 5)
+        etag = self.anonymous.get('/api/recipes/')['ETag']
+        cache.delete(RESPONSE_KEY.format('recipes:list:testserver:'))
+        # Без сохранённого ответа версии процесса не подтверждают ETag.
+        response = self.anonymous.get(
+            '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_shared_cache(self):
+        self.assertEqual(response_timeout(), 300)
+
+
+class SimilarityTagsTest(TestCase):
+    """Сходство учитывает и теги вне битовой маски."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='similar', email='similar@example.com',
+            first_name='similar', last_name='similar',
+        )
+        ingredient = Ingredient.objects.create(
+            name='similar', measurement_unit='г'
+        )
+        wide_tag = Tag.objects.create(
+            id=TAGS_MASK_BITS + 100, name='wide', slug='wide',
+            color='#ffffff',
+        )
+        cls.recipe, cls.tagged, cls.untagged = [
+            Recipe.objects.create(
+                author=author, name=name, text='text', cooking_time=10,
+                image='recipes/images/test.png',
+            ) for name in ('recipe', 'tagged', 'untagged')
+        ]
+        for recipe in (cls.recipe, cls.tagged, cls.untagged):
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=10
+            )
+        for recipe in (cls.recipe, cls.tagged):
+            TagInRecipe.objects.create(recipe=recipe, tag=wide_tag)
+
+    def assertTagCounts(self):
+        scores = dict(SimilarRecipe.objects.filter(
+            recipe=self.recipe
+        ).values_list('similar_id', 'score'))
+        self.assertGreater(scores[self.tagged.pk], scores[self.untagged.pk])
+
+    def test_update(self):
+        update_similar_recipes(self.recipe.pk)
+        self.assertTagCounts()
+
+    def test_build(self):
+        call_command('build_similar_recipes', workers=1, stdout=StringIO())
+        self.assertTagCounts()
+
+
+class SimilarRecipesTest(RecipeDataMixin, TestCase):
+    """Параметр limit похожих рецептов проверяется, а не угадывается."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        update_similar_recipes(cls.recipes[0].pk)
+
+    def get(self, query=''):
+        return self.anonymous.get(
+            f'/api/recipes/{self.recipes[0].pk}/similar/{query}'
+        )
+
+    def test_limit(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.data), 1)
+        response = self.get('?limit=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_invalid_limit(self):
+        for limit in ('abc', '0', '-1', settings.SIMILAR_RECIPES_COUNT + 1):
+            with self.subTest(limit=limit):
+                response = self.get(f'?limit={limit}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('limit', response.data)
+
+    def test_missing_recipe(self):
+        for pk in ('abc', max(recipe.pk for recipe in self.recipes) + 1):
+            with self.subTest(pk=pk):
+                response = self.anonymous.get(f'/api/recipes/{pk}/similar/')
+                self.assertEqual(response.status_code, 404)
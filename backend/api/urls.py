@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                    TagViewSet)
+from .views import (CustomUserViewSet, DatabasePoolStatsView,
+                    IngredientViewSet, RecipeViewSet, TagViewSet)
 
 app_name = 'api'
 
@@ -17,4 +17,9 @@ router.register('users', CustomUserViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
+    path(
+        'internal/db-pool/',
+        DatabasePoolStatsView.as_view(),
+        name='db-pool-stats'
+    ),
 ]
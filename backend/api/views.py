@@ -1,32 +1,71 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import os
+from functools import partial
+from itertools import groupby
+
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window)
+from django.db.models.functions import Greatest, RowNumber
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.permissions import (AllowAny, IsAuthenticated,
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from foodgram.db.pool import get_all_stats
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag, User)
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPagination
+                            ShoppingCart, ShoppingListItem, Tag, User)
+from recipes.trending import TRENDING_WEIGHTS, change_trending
+from users.models import Subscribe
+
+from .cache import (RECIPES_VERSION, REFERENCE_VERSION, author_version,
+                    cached_response, recipe_version)
+from .filters import RecipeFilter
+from .pagination import CustomPagination, RecipePagination
+from .pantry import pantry_index
 from .permissions import IsAuthorOrAdmin
-from .serializers import (IngredientSerializer, ProfileSerializer,
+from .registry import tag_registry
+from .renderers import CSVRenderer, PlainTextRenderer
+from .search import ingredient_index
+from .serializers import (IngredientSerializer, PantryQuerySerializer,
+                          PantryRecipeSerializer, ProfileSerializer,
                           RecipeListSerializer, RecipeSerializer,
-                          SubscribeListSerializer, SubscribeRecipeSerializer,
-                          TagSerializer)
+                          SimilarQuerySerializer, SubscribeListSerializer,
+                          SubscribeRecipeSerializer, TagSerializer)
+from .shopping_list import (CURSOR_CHUNK_SIZE, EXPORTERS,
+                            SHOPPING_LIST_FILENAME, buffered)
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count',
+}
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик field объекта на delta, не ниже нуля."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
 
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny, )
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientSearchFilter
+
+    def list(self, request, *args, **kwargs):
+        return Response(
+            ingredient_index.search(request.query_params.get('name', ''))
+        )
 
 
 class TagViewSet(ReadOnlyModelViewSet):
@@ -34,22 +73,93 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (AllowAny, )
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        content, etag = tag_registry.get_rendered()
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            tag = tag_registry.get(int(self.kwargs['pk']))
+        except ValueError:
+            tag = None
+        if tag is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(tag).data)
+
 
 class RecipeViewSet(ModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,
                           IsAuthorOrAdmin,)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
 
     def get_queryset(self):
-        return (Recipe.objects.all()
-                .select_related('author')
-                .prefetch_related('ingredients', 'tags')
-                .order_by('-id'))
+        queryset = (
+            Recipe.objects.all()
+            .select_related('author')
+            .prefetch_related(
+                Prefetch(
+                    'recipe_ingredients',
+                    queryset=IngredientInRecipe.objects.select_related(
+                        'ingredient'
+                    )
+                ),
+                'tags'
+            )
+            .order_by('-id')
+        )
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_author_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('author'))
+            )
+        )
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        change_counter(User, self.request.user.pk, 'recipes_count', 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        change_counter(User, instance.author_id, 'recipes_count', -1)
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        return cached_response(
+            request,
+            'recipes:list',
+            (RECIPES_VERSION, REFERENCE_VERSION),
+            partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        pk = self.kwargs['pk']
+        return cached_response(
+            request,
+            f'recipes:detail:{pk}',
+            (recipe_version(pk), REFERENCE_VERSION),
+            partial(super().retrieve, request, *args, **kwargs),
+            dependencies=lambda data: (author_version(data['author']['id']),)
+        )
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -63,14 +173,31 @@ class RecipeViewSet(ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
+        with transaction.atomic():
+            relation = model.objects.create(user=user, recipe=recipe)
+            change_counter(Recipe, pk, RECIPE_COUNTERS[model], 1)
+            change_trending(
+                pk, TRENDING_WEIGHTS[model], relation.created_at
+            )
         serializer = SubscribeRecipeSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_from(self, model, user, pk):
         obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        # Дата добавления нужна, чтобы снять ровно тот вклад в счёт
+        # популярности, который дала эта запись.
+        created_at = obj.values_list('created_at', flat=True).first()
+        if created_at is not None:
+            with transaction.atomic():
+                _, deleted = obj.delete()
+                deleted = deleted.get(model._meta.label, 0)
+                change_counter(
+                    Recipe, pk, RECIPE_COUNTERS[model], -deleted
+                )
+                if deleted:
+                    change_trending(
+                        pk, -TRENDING_WEIGHTS[model], created_at
+                    )
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'Этот рецепт уже удален!'},
@@ -107,33 +234,105 @@ class RecipeViewSet(ModelViewSet):
             return self.add_to(ShoppingCart, request.user, pk)
         return self.delete_from(ShoppingCart, request.user, pk)
 
+    @action(
+        methods=['GET'],
+        detail=True,
+        permission_classes=(AllowAny, )
+    )
+    def similar(self, request, pk):
+        """Похожие рецепты из таблицы соседей, не больше limit."""
+        try:
+            pk = int(pk)
+        except ValueError:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        query = SimilarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        limit = query.validated_data['limit']
+        recipes = list(
+            Recipe.objects.filter(similar_to__recipe_id=pk).only(
+                'id', 'name', 'image', 'thumbnails', 'cooking_time'
+            ).order_by('-similar_to__score', 'id')[:limit]
+        )
+        if not recipes and not Recipe.objects.filter(pk=pk).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(SubscribeRecipeSerializer(recipes, many=True).data)
+
     @action(
         methods=['GET'],
         detail=False,
-        permission_classes=(IsAuthenticated, )
+        permission_classes=(AllowAny, )
     )
-    def download_shopping_cart(self, request):
-        ingredient_list = 'Cписок покупок:'
+    def pantry(self, request):
+        """Рецепты из имеющихся ингредиентов (параметры ingredients).
 
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        for ingredient in ingredients:
-            ingredient_name = ingredient['ingredient__name']
-            measurement_unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['amount']
-            ingredient_list += (
-                f'\n{ingredient_name} - {amount} {measurement_unit}'
+        Ранжирование и отбор по max_missing выполняет индекс в памяти
+        процесса; из БД читается только текущая страница.
+        """
+        query = PantryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        pantry = set(query.validated_data['ingredients'])
+        recipe_ids, coverage, _ = pantry_index.match(
+            pantry, query.validated_data['max_missing']
+        )
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(
+            list(zip(recipe_ids.tolist(), coverage.tolist())), request, self
+        )
+        recipes = Recipe.objects.filter(
+            id__in=[recipe_id for recipe_id, _ in page]
+        ).only(
+            'id', 'name', 'image', 'thumbnails', 'cooking_time'
+        ).prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name')
             )
+        ).in_bulk()
+        results = []
+        for recipe_id, recipe_coverage in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = recipe_coverage
+            recipe.missing_ingredients = [
+                item.ingredient for item in recipe.recipe_ingredients.all()
+                if item.ingredient_id not in pantry
+            ]
+            results.append(recipe)
+        return paginator.get_paginated_response(
+            PantryRecipeSerializer(results, many=True).data
+        )
 
-        file = 'shopping_list'
-        response = HttpResponse(ingredient_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer)
+    )
+    def download_shopping_cart(self, request):
+        export_format = request.query_params.get('format', 'txt')
+        exporter, content_type = EXPORTERS[export_format]
+
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values(
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).order_by('name', 'measurement_unit')
 
+        response = StreamingHttpResponse(
+            buffered(exporter(
+                ingredients.iterator(chunk_size=CURSOR_CHUNK_SIZE)
+            )),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            'attachment; '
+            f'filename="{SHOPPING_LIST_FILENAME}.{export_format}"'
+        )
         return response
 
 
@@ -142,6 +341,17 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = ProfileSerializer
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+            )
+        )
+
     @action(
         detail=False,
         permission_classes=(IsAuthenticated, ),
@@ -171,7 +381,12 @@ class CustomUserViewSet(UserViewSet):
                 author, data=request.data, context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            user.subscriber.create(author=author)
+            with transaction.atomic():
+                user.subscriber.create(author=author)
+                change_counter(User, author.pk, 'followers_count', 1)
+            author.followers_count += 1
+            author.is_subscribed = True
+            self.attach_recipes_preview([author])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         subscription = user.subscriber.filter(author=author).first()
@@ -180,7 +395,9 @@ class CustomUserViewSet(UserViewSet):
                 {'error': 'Вы не подписаны на этого пользователя!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        subscription.delete()
+        with transaction.atomic():
+            subscription.delete()
+            change_counter(User, author.pk, 'followers_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -190,9 +407,68 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = User.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
         pages = self.paginate_queryset(queryset)
+        self.attach_recipes_preview(pages)
         serializer = SubscribeListSerializer(
             pages, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
+
+    def get_recipes_limit(self):
+        limit = self.request.query_params.get('recipes_limit')
+        try:
+            return max(int(limit), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def attach_recipes_preview(self, authors):
+        """Загружает превью рецептов всех авторов страницы одним запросом.
+
+        С параметром recipes_limit первые рецепты каждого автора
+        отбираются оконной функцией ROW_NUMBER() с разбиением по автору;
+        если СУБД не поддерживает оконные функции (старые версии SQLite),
+        лишние рецепты отбрасываются на стороне Python.
+        """
+        if not authors:
+            return
+        limit = self.get_recipes_limit()
+        recipes = Recipe.objects.filter(author__in=authors).only(
+            'id', 'name', 'image', 'thumbnails', 'cooking_time', 'author_id'
+        )
+        if limit is None:
+            recipes = recipes.order_by('author_id', 'name', 'id')
+        elif connection.features.supports_over_clause:
+            ranked = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('name').asc(), F('id').asc())
+            ))
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                'WHERE ranked.row_number <= %s '
+                'ORDER BY ranked.author_id, ranked.row_number',
+                (*params, limit)
+            )
+        else:
+            recipes = recipes.order_by('author_id', 'name', 'id')
+        previews = {
+            author_id: list(author_recipes)[:limit]
+            for author_id, author_recipes in groupby(
+                recipes, key=lambda recipe: recipe.author_id
+            )
+        }
+        for author in authors:
+            author.recipes_preview = previews.get(author.id, [])
+
+
+class DatabasePoolStatsView(APIView):
+    """Статистика пулов соединений с БД процесса, обслужившего запрос."""
+
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        return Response({'pid': os.getpid(), 'pools': get_all_stats()})
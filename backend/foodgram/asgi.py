@@ -2,6 +2,8 @@
 ASGI config for foodgram project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Synchronous views are executed in bounded thread pools, see
+``foodgram.handlers.ThreadPoolASGIHandler``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -9,8 +11,12 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from foodgram.handlers import ThreadPoolASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+application = ThreadPoolASGIHandler()
@@ -0,0 +1,22 @@
+class DerivedFieldsMixin:
+    """Модель с производными полями, которые save() не перезаписывает.
+
+    Производные поля (DERIVED_FIELDS) меняются только атомарными UPDATE
+    через F() или фоновыми задачами. Полное сохранение существующей
+    строки записало бы значения, прочитанные в начале запроса, и
+    потеряло бы параллельные изменения, поэтому оно сохраняет все
+    загруженные поля, кроме производных.
+    """
+
+    DERIVED_FIELDS = frozenset()
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.DERIVED_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
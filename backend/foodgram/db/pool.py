@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений psycopg2 одного процесса.
+
+    Держит не больше size соединений; соединение старше lifetime секунд
+    закрывается при возврате или выдаче. С pre_ping перед выдачей
+    простаивавшее соединение проверяется запросом SELECT 1, сломанные
+    соединения отбрасываются. Если свободных нет, поток ждёт до timeout
+    секунд. params — параметры соединения, для которых создан пул.
+    """
+
+    def __init__(self, size, lifetime, timeout, pre_ping, params=None):
+        self.params = params
+        self.size = size
+        self.lifetime = lifetime
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.created = {}
+        self.opening = 0
+        self.stats = {
+            'opened': 0,
+            'closed': 0,
+            'broken': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'max_in_use': 0,
+        }
+
+    def expired(self, connection):
+        return (
+            time.monotonic() - self.created[id(connection)] > self.lifetime
+        )
+
+    def discard(self, connection, broken=False):
+        """Закрывает соединение и освобождает место в пуле."""
+        with self.condition:
+            self.created.pop(id(connection), None)
+            self.stats['closed'] += 1
+            self.stats['broken'] += broken
+            self.condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def is_alive(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def in_use(self):
+        return len(self.created) - len(self.idle)
+
+    def acquire(self, connect):
+        """Свободное соединение из пула или новое, открытое через connect."""
+        deadline = None
+        while True:
+            with self.condition:
+                connection = None
+                if self.idle:
+                    connection = self.idle.pop()
+                elif len(self.created) + self.opening < self.size:
+                    self.opening += 1
+                else:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.timeout
+                        self.stats['waits'] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise OperationalError(
+                            f'Пул соединений исчерпан: {self.size} '
+                            f'соединений заняты дольше {self.timeout} с'
+                        )
+                    started = time.monotonic()
+                    self.condition.wait(remaining)
+                    self.stats['wait_time'] += time.monotonic() - started
+                    continue
+            if connection is None:
+                return self.open(connect)
+            if connection.closed or self.expired(connection):
+                self.discard(connection)
+                continue
+            if self.pre_ping and not self.is_alive(connection):
+                self.discard(connection, broken=True)
+                continue
+            self.track_usage()
+            return connection
+
+    def open(self, connect):
+        """Открывает соединение на место, зарезервированное в acquire."""
+        try:
+            connection = connect()
+        except Exception:
+            with self.condition:
+                self.opening -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.opening -= 1
+            self.created[id(connection)] = time.monotonic()
+            self.stats['opened'] += 1
+        self.track_usage()
+        return connection
+
+    def track_usage(self):
+        with self.condition:
+            self.stats['max_in_use'] = max(
+                self.stats['max_in_use'], self.in_use()
+            )
+
+    def release(self, connection):
+        """Возвращает соединение в пул, откатив незавершённую транзакцию."""
+        if id(connection) not in self.created:
+            connection.close()
+            return
+        if connection.closed:
+            self.discard(connection, broken=True)
+            return
+        if self.closed:
+            self.discard(connection)
+            return
+        try:
+            if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception:
+            self.discard(connection, broken=True)
+            return
+        if self.expired(connection):
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def close(self):
+        """Закрывает свободные соединения, занятые — при возврате."""
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, deque()
+        for connection in idle:
+            self.discard(connection)
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'lifetime': self.lifetime,
+                'open': len(self.created),
+                'in_use': self.in_use(),
+                'idle': len(self.idle),
+                **self.stats,
+                'wait_time': round(self.stats['wait_time'], 3),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, params, factory):
+    """Пул для alias в текущем процессе.
+
+    После fork пул создаётся заново. При смене параметров соединения
+    (например, имени базы на время тестов) прежний пул закрывается,
+    чтобы его соединения не выдавались к другой базе.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is not None and pool.pid == os.getpid():
+            if pool.params == params:
+                return pool
+            pool.close()
+        pool = _pools[alias] = factory()
+        return pool
+
+
+def close_pool(alias):
+    """Закрывает пул alias текущего процесса, если он есть."""
+    with _pools_lock:
+        pool = _pools.pop(alias, None)
+    if pool is not None and pool.pid == os.getpid():
+        pool.close()
+
+
+def get_all_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {
+        alias: pool.get_stats() for alias, pool in pools.items()
+        if pool.pid == os.getpid()
+    }
@@ -0,0 +1,50 @@
+from functools import partial
+
+from django.db.backends.postgresql import base
+
+from ..pool import ConnectionPool, get_pool
+from .creation import DatabaseCreation
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Бэкенд PostgreSQL, берущий соединения из пула процесса.
+
+    Настройки пула задаются ключом POOL в DATABASES: SIZE (0 отключает
+    пул), LIFETIME и TIMEOUT в секундах, PRE_PING. Django по-прежнему
+    «закрывает» соединение в конце запроса, но оно возвращается в пул,
+    поэтому CONN_MAX_AGE должен оставаться равным 0.
+    """
+
+    creation_class = DatabaseCreation
+    # Пул, из которого взято текущее соединение.
+    pool = None
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('SIZE'):
+            return None
+        return get_pool(self.alias, conn_params, lambda: ConnectionPool(
+            size=options['SIZE'],
+            lifetime=options.get('LIFETIME', 3600),
+            timeout=options.get('TIMEOUT', 30),
+            pre_ping=options.get('PRE_PING', True),
+            params=conn_params,
+        ))
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        if self.pool is None:
+            return super().get_new_connection(conn_params)
+        connection = self.pool.acquire(
+            partial(super().get_new_connection, conn_params)
+        )
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            return self.pool.release(self.connection)
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import creation
+
+from ..pool import close_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Свободные соединения пула с тестовой базой не дали бы её удалить.
+        close_pool(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+# Маршруты, которые долго держат поток: экспорт, декодирование
+# картинок, выборка подписок с превью рецептов.
+HEAVY_ROUTES = {
+    ('api:recipes-download-shopping-cart', 'GET'),
+    ('api:recipes-list', 'POST'),
+    ('api:recipes-detail', 'PUT'),
+    ('api:recipes-detail', 'PATCH'),
+    ('api:customuser-subscriptions', 'GET'),
+}
+# Сколько частей потокового ответа может ждать отправки.
+STREAM_BUFFER = 8
+
+
+class ThreadPoolASGIHandler(ASGIHandler):
+    """ASGI-обработчик, выполняющий синхронные view в пулах потоков.
+
+    Стандартный ASGIHandler Django 3.2 выполняет синхронный код всех
+    запросов в одном общем потоке. Здесь весь синхронный стек
+    middleware и view выполняется в пуле ASGI_THREADS потоков, а тяжёлые
+    маршруты — в отдельном пуле ASGI_HEAVY_THREADS, чтобы они не
+    занимали потоки лёгких запросов. Потоковые ответы генерируются
+    в пуле тяжёлых запросов и отправляются из цикла событий через
+    ограниченную очередь.
+    """
+
+    def __init__(self):
+        super(ASGIHandler, self).__init__()
+        self.load_middleware()
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_THREADS,
+            thread_name_prefix='asgi'
+        )
+        self.heavy_executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_HEAVY_THREADS,
+            thread_name_prefix='asgi-heavy'
+        )
+
+    def get_executor(self, request):
+        try:
+            route = resolve(request.path_info).view_name
+        except Resolver404:
+            return self.executor
+        if (route, request.method) in HEAVY_ROUTES:
+            return self.heavy_executor
+        return self.executor
+
+    def get_response_in_thread(self, request):
+        close_old_connections()
+        try:
+            return self.get_response(request)
+        finally:
+            close_old_connections()
+
+    async def get_response_async(self, request):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.get_executor(request), self.get_response_in_thread, request
+        )
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(STREAM_BUFFER)
+        stop = threading.Event()
+        producer = loop.run_in_executor(
+            self.heavy_executor, self.produce, response, queue, loop, stop
+        )
+        finished = False
+        try:
+            while True:
+                part = await queue.get()
+                if part is None:
+                    finished = True
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            stop.set()
+            while not finished:
+                finished = await queue.get() is None
+            await producer
+
+    @staticmethod
+    def produce(response, queue, loop, stop):
+        """Итерирует потоковый ответ в одном потоке пула.
+
+        Весь генератор, включая серверный курсор БД, живёт в этом
+        потоке; части передаются в цикл событий с ожиданием места
+        в очереди.
+        """
+        try:
+            for part in response:
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(
+                    queue.put(part), loop
+                ).result()
+        finally:
+            try:
+                response.close()
+            finally:
+                asyncio.run_coroutine_threadsafe(
+                    queue.put(None), loop
+                ).result()
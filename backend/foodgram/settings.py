@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,15 +74,58 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.db.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', 5432),
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE', 10)),
+            'LIFETIME': int(os.getenv('DB_POOL_LIFETIME', 3600)),
+            'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+            'PRE_PING': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        },
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', 300))
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+RESPONSE_CACHE_LOCAL_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_LOCAL_TIMEOUT', 5)
+)
+
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', 10))
+SIMILAR_RECIPES_WORKERS = int(os.getenv('SIMILAR_RECIPES_WORKERS', 1))
+SIMILAR_RECIPES_QUEUE_SIZE = int(
+    os.getenv('SIMILAR_RECIPES_QUEUE_SIZE', 100)
+)
+
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 72))
+
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', 5))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 8))
+ASGI_HEAVY_THREADS = int(os.getenv('ASGI_HEAVY_THREADS', 4))
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_THRESHOLD_MS = int(os.getenv('PROFILING_THRESHOLD_MS', 0))
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -125,6 +169,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/backend_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+RECIPE_THUMBNAIL_WIDTHS = tuple(
+    int(width) for width in os.getenv(
+        'RECIPE_THUMBNAIL_WIDTHS', '160,320,640'
+    ).split(',')
+)
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_QUEUE_SIZE = int(os.getenv('THUMBNAIL_QUEUE_SIZE', 100))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -132,7 +184,7 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -1,9 +1,25 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
 from django.contrib.admin import display
+from django.db import transaction
 
 from .form import AtLeastOneRequiredInlineFormSet
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Tag, TagInRecipe)
+                     ShoppingCart, ShoppingListItem, Tag, TagInRecipe)
+
+
+@contextmanager
+def shopping_totals(recipe_ids):
+    """Переносит в итоги списков покупок правку состава рецептов."""
+    with transaction.atomic():
+        old_amounts = {
+            recipe_id: ShoppingListItem.objects.recipe_amounts(recipe_id)
+            for recipe_id in recipe_ids
+        }
+        yield
+        for recipe_id, amounts in old_amounts.items():
+            ShoppingListItem.objects.change_recipe(recipe_id, amounts)
 
 
 class IngredientsInLine(admin.TabularInline):
@@ -38,15 +54,39 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags',)
     inlines = (IngredientsInLine, TagsInLine)
 
+    def save_related(self, request, form, formsets, change):
+        with shopping_totals((form.instance.pk,)):
+            super().save_related(request, form, formsets, change)
+
     @display(description='Количество в избранных')
     def count_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(IngredientInRecipe)
 class IngredientInRecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'recipe', 'ingredient', 'amount',)
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change:
+            # Строку могли перенести в другой рецепт.
+            recipe_ids.add(IngredientInRecipe.objects.values_list(
+                'recipe_id', flat=True
+            ).get(pk=obj.pk))
+        with shopping_totals(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with shopping_totals((obj.recipe_id,)):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with shopping_totals(set(
+            queryset.values_list('recipe_id', flat=True)
+        )):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(TagInRecipe)
 class TagInRecipeAdmin(admin.ModelAdmin):
@@ -55,9 +95,9 @@ class TagInRecipeAdmin(admin.ModelAdmin):
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe',)
+    list_display = ('user', 'recipe', 'created_at',)
 
 
 @admin.register(ShoppingCart)
 class FavouriteAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe',)
+    list_display = ('user', 'recipe', 'created_at',)
@@ -8,3 +8,4 @@ MAX_INGREDIENT_AMOUNT = 32000
 MIN_INGREDIENT_AMOUNT = 1
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32000
+TAGS_MASK_BITS = 63
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+TAGS_MASK_BITS = 63
+
+
+def fill_tags_mask(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TagInRecipe = apps.get_model('recipes', 'TagInRecipe')
+    masks = {}
+    for recipe_id, tag_id in TagInRecipe.objects.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator():
+        if tag_id < TAGS_MASK_BITS:
+            masks[recipe_id] = masks.get(recipe_id, 0) | 1 << tag_id
+    recipes = [Recipe(pk=pk, tags_mask=mask) for pk, mask in masks.items()]
+    Recipe.objects.bulk_update(recipes, ('tags_mask',), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Битовая маска тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_tags_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Превью картинки'),
+        ),
+    ]
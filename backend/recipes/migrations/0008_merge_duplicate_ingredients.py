@@ -0,0 +1,64 @@
+from django.db import migrations
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Count, Min
+
+
+def merge_rows(model, owner, keep, duplicates):
+    """Переносит строки model на ингредиент keep, складывая количества.
+
+    Сумма ограничивается наибольшим значением колонки amount (SQLite
+    его не проверяет, но PostgreSQL отверг бы строку).
+    """
+    _, max_amount = BaseDatabaseOperations.integer_field_ranges[
+        model._meta.get_field('amount').get_internal_type()
+    ]
+    rows = sorted(
+        model.objects.filter(ingredient_id__in=(keep, *duplicates)),
+        key=lambda row: (row.ingredient_id != keep, row.id)
+    )
+    survivors = {}
+    for row in rows:
+        survivor = survivors.get(getattr(row, owner))
+        if survivor is None:
+            survivors[getattr(row, owner)] = row
+            if row.ingredient_id != keep:
+                row.ingredient_id = keep
+                row.save(update_fields=('ingredient',))
+            continue
+        survivor.amount = min(
+            (survivor.amount or 0) + (row.amount or 0), max_amount
+        )
+        survivor.save(update_fields=('amount',))
+        row.delete()
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    groups = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), total=Count('id')).filter(
+        total__gt=1
+    ).order_by()
+    for group in groups.iterator():
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep']).values_list('id', flat=True))
+        merge_rows(IngredientInRecipe, 'recipe_id', group['keep'], duplicates)
+        merge_rows(ShoppingListItem, 'user_id', group['keep'], duplicates)
+        Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,79 @@
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Документы рецептов: название, ингредиенты и описание с весами A, B, C.
+POSTGRES_DOCUMENTS = """
+    INSERT INTO recipes_recipe_search (recipe_id, document)
+    SELECT recipe.id,
+        setweight(to_tsvector('russian', recipe.name), 'A')
+        || setweight(to_tsvector(
+            'russian', coalesce(string_agg(ingredient.name, ' '), '')
+        ), 'B')
+        || setweight(to_tsvector('russian', recipe.text), 'C')
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientinrecipe item ON item.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = item.ingredient_id
+    GROUP BY recipe.id
+"""
+SQLITE_DOCUMENTS = """
+    INSERT INTO recipes_recipe_search (rowid, name, ingredients, text)
+    SELECT recipe.id, recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''), recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientinrecipe item ON item.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = item.ingredient_id
+    GROUP BY recipe.id
+"""
+
+CREATE = {
+    'postgresql': (
+        'CREATE TABLE recipes_recipe_search ('
+        'recipe_id bigint PRIMARY KEY REFERENCES recipes_recipe (id) '
+        'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+        'document tsvector NOT NULL)',
+        'CREATE INDEX recipe_search_document_idx '
+        'ON recipes_recipe_search USING gin (document)',
+        POSTGRES_DOCUMENTS,
+    ),
+    'sqlite': (
+        'CREATE VIRTUAL TABLE recipes_recipe_search USING fts5('
+        'name, ingredients, text, '
+        "tokenize = 'unicode61 remove_diacritics 2')",
+        SQLITE_DOCUMENTS,
+    ),
+}
+
+
+def create_search_table(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(statement)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute('DROP TABLE recipes_recipe_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearch',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe')),
+                ('document', django.contrib.postgres.search.SearchVectorField()),
+            ],
+            options={
+                'db_table': 'recipes_recipe_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:15
+
+import django.core.validators
+from django.db import migrations, models
+
+# Расхождения моделей с начальными миграциями: параметры Meta и
+# валидаторы (без изменений схемы), уникальность ингредиента уже
+# обеспечивает ограничение unique_ingredient из 0009.
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_trending'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ('name',), 'verbose_name': 'Рецепт', 'verbose_name_plural': 'Рецепты'},
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(32000)], verbose_name='Количество'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(32000)], verbose_name='Время приготовления (в минутах)'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingredient',
+            unique_together=set(),
+        ),
+    ]
@@ -1,9 +1,15 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import (MinValueValidator,
                                     MaxValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from foodgram.db.models import DerivedFieldsMixin
 
 # Import constants
 from .constant import (MAX_LENGTH,
@@ -11,7 +17,9 @@ from .constant import (MAX_LENGTH,
                        MIN_AMOUNT_VALIDATOR,
                        MAX_AMOUNT_VALIDATOR,
                        MIN_COOKING_TIME,
-                       MAX_COOKING_TIME)
+                       MAX_COOKING_TIME,
+                       TAGS_MASK_BITS)
+from .storage import recipe_image_storage
 
 User = get_user_model()
 
@@ -32,6 +40,12 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'
+            ),
+        )
 
     def __str__(self):
         return f'{self.name} {self.measurement_unit}'
@@ -68,16 +82,21 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(DerivedFieldsMixin, models.Model):
     """Модель рецептов."""
 
+    DERIVED_FIELDS = frozenset(
+        {'favorites_count', 'shopping_cart_count', 'thumbnails'}
+    )
+
     name = models.CharField(
         max_length=MAX_LENGTH,
         verbose_name='Название рецепта'
     )
     image = models.ImageField(
         verbose_name='Картинка',
-        upload_to='recipes/images'
+        upload_to='recipes/images',
+        storage=recipe_image_storage
     )
     text = models.TextField(
         'Описание рецепта'
@@ -104,15 +123,90 @@ class Recipe(models.Model):
         verbose_name='Теги',
         related_name='recipes'
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество в избранном',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Количество в списках покупок',
+        default=0,
+        editable=False
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Битовая маска тегов',
+        default=0,
+        editable=False
+    )
+    thumbnails = models.JSONField(
+        verbose_name='Превью картинки',
+        default=dict,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('name',)
+        indexes = (
+            # Условие (tags_mask & N) > 0 не ищется по B-tree, но COUNT(*)
+            # фильтра по тегам читает этот узкий индекс целиком (index-only
+            # scan) вместо строк рецептов.
+            models.Index(fields=('tags_mask',), name='recipe_tags_mask_idx'),
+        )
 
     def __str__(self):
         return self.name
 
+    @property
+    def thumbnails_ready(self):
+        return bool(
+            self.image
+            and self.thumbnails.get('source') == self.image.name
+        )
+
+    @staticmethod
+    def get_tags_mask(tag_ids):
+        """Маска, в которой бит i означает тег с id == i.
+
+        Теги с id >= TAGS_MASK_BITS в маску не попадают и фильтруются
+        через EXISTS по TagInRecipe.
+        """
+        mask = 0
+        for tag_id in tag_ids:
+            if tag_id < TAGS_MASK_BITS:
+                mask |= 1 << tag_id
+        return mask
+
+    @staticmethod
+    def tags_mask_subquery():
+        """Маска тегов рецепта OuterRef('pk'), посчитанная в SQL.
+
+        Пары (тег, рецепт) уникальны, поэтому сумма битов равна их OR.
+        """
+        bit = Cast(Value(1), models.BigIntegerField()).bitleftshift(
+            Cast(F('tag_id'), models.IntegerField())
+        )
+        return Coalesce(
+            Subquery(
+                TagInRecipe.objects.filter(
+                    recipe=OuterRef('pk'), tag_id__lt=TAGS_MASK_BITS
+                ).order_by().values('recipe').annotate(
+                    mask=Sum(bit, output_field=models.BigIntegerField())
+                ).values('mask')
+            ),
+            0,
+            output_field=models.BigIntegerField()
+        )
+
+    def update_tags_mask(self):
+        self.tags_mask = self.get_tags_mask(
+            TagInRecipe.objects.filter(recipe=self).values_list(
+                'tag_id', flat=True
+            )
+        )
+        Recipe.objects.filter(pk=self.pk).update(tags_mask=self.tags_mask)
+
 
 class IngredientInRecipe(models.Model):
     """Модель для связи ингредиента и рецепта."""
@@ -151,11 +245,119 @@ class TagInRecipe(models.Model):
     class Meta:
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецепта'
+        # Индекс ограничения обслуживает и выборку рецептов по тегу.
+        constraints = (
+            models.UniqueConstraint(
+                fields=('tag', 'recipe'),
+                name='unique_tag_in_recipe'
+            ),
+        )
 
     def __str__(self):
         return self.tag.name
 
 
+class RecipeSearch(models.Model):
+    """Поисковый документ рецепта в PostgreSQL.
+
+    Таблица создаётся миграцией отдельно для каждой СУБД (в SQLite —
+    виртуальная таблица FTS5) и заполняется функциями recipes.search.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name='search_document'
+    )
+    document = SearchVectorField()
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_search'
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт: заранее посчитанный сосед по ингредиентам и тегам.
+
+    Таблица строится командой build_similar_recipes и обновляется для
+    одного рецепта при его изменении.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar}'
+
+
+class TrendingRecipe(models.Model):
+    """Счёт популярности рецепта с экспоненциальным затуханием.
+
+    Счёт хранится в единицах эпохи TrendingState: вклад события
+    равен весу, умноженному на 2 ** (возраст эпохи / период
+    полураспада), поэтому старые значения не пересчитываются при
+    каждом событии. Порядок по score совпадает с порядком по
+    текущему счёту.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(verbose_name='Счёт')
+
+    class Meta:
+        verbose_name = 'Популярный рецепт'
+        verbose_name_plural = 'Популярные рецепты'
+        indexes = (
+            models.Index(
+                fields=('-score', '-recipe'),
+                name='trending_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:.3f}'
+
+
+class TrendingState(models.Model):
+    """Единственная строка с эпохой счёта популярных рецептов."""
+
+    epoch = models.DateTimeField(verbose_name='Эпоха')
+
+    class Meta:
+        verbose_name = 'Состояние популярных рецептов'
+        verbose_name_plural = 'Состояние популярных рецептов'
+
+    def __str__(self):
+        return f'{self.epoch:%Y-%m-%d %H:%M}'
+
+
 class Favorite(models.Model):
     """Модель для отображения избранного."""
 
@@ -170,6 +372,10 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -199,6 +405,10 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -212,3 +422,128 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в список покупок'
+
+
+class ShoppingListItemManager(models.Manager):
+    """Инкрементальное обновление итогов списка покупок."""
+
+    @staticmethod
+    def recipe_amounts(recipe):
+        return {
+            ingredient_id: amount or 0
+            for ingredient_id, amount in IngredientInRecipe.objects.filter(
+                recipe=recipe
+            ).values_list('ingredient_id', 'amount')
+        }
+
+    def apply(self, deltas):
+        """Прибавляет к итогам изменения {(user_id, ingredient_id): delta}.
+
+        Недостающие строки вставляются с нулём, затем все затронутые
+        строки блокируются и обновляются одним bulk_update; строки
+        с нулевым итогом удаляются.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = {user_id for user_id, _ in deltas}
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        with transaction.atomic():
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id, ingredient_id=ingredient_id, amount=0
+                    ) for user_id, ingredient_id in deltas
+                ),
+                ignore_conflicts=True
+            )
+            items = self.select_for_update().filter(
+                user_id__in=user_ids, ingredient_id__in=ingredient_ids
+            )
+            changed = []
+            for item in items:
+                delta = deltas.get((item.user_id, item.ingredient_id))
+                if delta:
+                    item.amount = max(item.amount + delta, 0)
+                    changed.append(item)
+            self.bulk_update(changed, ('amount',))
+            self.filter(
+                user_id__in=user_ids,
+                ingredient_id__in=ingredient_ids,
+                amount=0
+            ).delete()
+
+    def add_recipe(self, user_id, recipe, sign=1):
+        self.apply({
+            (user_id, ingredient_id): sign * amount
+            for ingredient_id, amount in self.recipe_amounts(recipe).items()
+        })
+
+    def change_recipe(self, recipe, old_amounts, new_amounts=None):
+        """Переносит в итоги изменение состава рецепта в корзинах."""
+        if new_amounts is None:
+            new_amounts = self.recipe_amounts(recipe)
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            ) for ingredient_id in new_amounts.keys() | old_amounts.keys()
+        }
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        user_ids = ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True)
+        self.apply({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in changes.items()
+        })
+
+    @staticmethod
+    def compute_totals():
+        """Итоги, посчитанные заново по корзинам и составу рецептов."""
+        return IngredientInRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False,
+            amount__gt=0
+        ).values_list(
+            'recipe__shopping_cart__user_id', 'ingredient_id'
+        ).annotate(
+            total=Sum('amount')
+        ).order_by()
+
+
+class ShoppingListItem(models.Model):
+    """Модель итогового количества ингредиента в списке покупок."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        default=0
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
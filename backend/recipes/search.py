@@ -0,0 +1,133 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+
+SEARCH_TABLE = 'recipes_recipe_search'
+SEARCH_CONFIG = 'russian'
+# Поля документа, влияющие на поиск; прочие изменения рецепта
+# (превью, маска тегов) индекс не пересобирают.
+SEARCH_FIELDS = {'name', 'text'}
+MAX_TERMS = 8
+CHUNK_SIZE = 500
+WORD = re.compile(r'\w+')
+
+POSTGRES_UPDATE = f"""
+    INSERT INTO {SEARCH_TABLE} (recipe_id, document)
+    SELECT recipe.id,
+        setweight(to_tsvector(%(config)s::regconfig, recipe.name), 'A')
+        || setweight(to_tsvector(
+            %(config)s::regconfig,
+            coalesce(string_agg(ingredient.name, ' '), '')
+        ), 'B')
+        || setweight(to_tsvector(%(config)s::regconfig, recipe.text), 'C')
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientinrecipe item ON item.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = item.ingredient_id
+    WHERE recipe.id = ANY(%(ids)s)
+    GROUP BY recipe.id
+    ON CONFLICT (recipe_id) DO UPDATE SET document = EXCLUDED.document
+"""
+SQLITE_UPDATE = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, name, ingredients, text)
+    SELECT recipe.id, recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''), recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientinrecipe item ON item.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = item.ingredient_id
+    WHERE recipe.id IN ({{}})
+    GROUP BY recipe.id
+"""
+# bm25 меньше у более релевантных; веса колонок name, ingredients, text.
+SQLITE_RANK = f'-bm25({SEARCH_TABLE}, 10.0, 4.0, 1.0)'
+
+
+def search_terms(value):
+    return WORD.findall(value.casefold())[:MAX_TERMS]
+
+
+def chunks(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), CHUNK_SIZE):
+        yield recipe_ids[start:start + CHUNK_SIZE]
+
+
+def update_search_index(recipe_ids):
+    """Пересобирает поисковые документы рецептов recipe_ids.
+
+    Документ состоит из названия, названий ингредиентов и описания;
+    в PostgreSQL им назначены веса A, B и C.
+    """
+    with connection.cursor() as cursor:
+        for chunk in chunks(recipe_ids):
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    POSTGRES_UPDATE, {'config': SEARCH_CONFIG, 'ids': chunk}
+                )
+            elif connection.vendor == 'sqlite':
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f'DELETE FROM {SEARCH_TABLE} '
+                    f'WHERE rowid IN ({placeholders})',
+                    chunk
+                )
+                cursor.execute(SQLITE_UPDATE.format(placeholders), chunk)
+
+
+def delete_from_search_index(recipe_ids):
+    if connection.vendor == 'postgresql':
+        column = 'recipe_id'
+    elif connection.vendor == 'sqlite':
+        column = 'rowid'
+    else:
+        return
+    with connection.cursor() as cursor:
+        for chunk in chunks(recipe_ids):
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} WHERE {column} IN '
+                f'({", ".join(["%s"] * len(chunk))})',
+                chunk
+            )
+
+
+def search_recipes(queryset, value):
+    """Рецепты, содержащие все слова value (по началу слова).
+
+    Результат упорядочен по релевантности в аннотации search_rank.
+    """
+    terms = search_terms(value)
+    if not terms:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            config=SEARCH_CONFIG,
+            search_type='raw'
+        )
+        queryset = queryset.filter(
+            search_document__document=query
+        ).annotate(
+            search_rank=SearchRank(F('search_document__document'), query)
+        )
+    elif connection.vendor == 'sqlite':
+        # Соединение с FTS5: bm25 считается один раз для каждого
+        # найденного рецепта, а не коррелированным подзапросом.
+        queryset = queryset.extra(
+            select={'search_rank': SQLITE_RANK},
+            tables=(SEARCH_TABLE,),
+            where=(
+                f'{SEARCH_TABLE} MATCH %s',
+                f'{SEARCH_TABLE}.rowid = recipes_recipe.id',
+            ),
+            params=(' '.join(f'"{term}"*' for term in terms),)
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) | Q(text__icontains=term)
+            )
+        return queryset
+    return queryset.order_by('-search_rank', '-id')
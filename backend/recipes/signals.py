@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .constant import TAGS_MASK_BITS
+from .models import (Ingredient, IngredientInRecipe, Recipe, ShoppingCart,
+                     ShoppingListItem, Tag, TagInRecipe)
+from .search import (SEARCH_FIELDS, delete_from_search_index,
+                     update_search_index)
+from .similarity import schedule_similar_recipes
+from .thumbnails import schedule_thumbnails
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    ShoppingListItem.objects.add_recipe(
+        instance.user_id, instance.recipe_id, sign=-1
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+def remove_tag_from_masks(sender, instance, **kwargs):
+    if instance.id < TAGS_MASK_BITS:
+        Recipe.objects.filter(tags=instance).update(
+            tags_mask=F('tags_mask').bitand(~(1 << instance.id))
+        )
+
+
+@receiver((post_save, post_delete), sender=TagInRecipe)
+def update_tags_mask(sender, instance, **kwargs):
+    # Маску пересчитывает и правка связи в обход сериализатора
+    # (например, в админке).
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        tags_mask=Recipe.tags_mask_subquery()
+    )
+    schedule_similar_recipes(instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_thumbnails(sender, instance, **kwargs):
+    if instance.image and not instance.thumbnails_ready:
+        schedule_thumbnails(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def reindex_recipe(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not SEARCH_FIELDS & set(update_fields):
+        return
+    # Ингредиенты нового рецепта сохраняются после самого рецепта.
+    transaction.on_commit(lambda: update_search_index((instance.pk,)))
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_similar_recipes(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'tags_mask' not in update_fields:
+        return
+    schedule_similar_recipes(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_index(sender, instance, **kwargs):
+    delete_from_search_index((instance.pk,))
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, **kwargs):
+    if created:
+        return
+    transaction.on_commit(lambda: update_search_index(
+        IngredientInRecipe.objects.filter(
+            ingredient_id=instance.pk
+        ).values_list('recipe_id', flat=True)
+    ))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def reindex_recipes_without_ingredient(sender, instance, **kwargs):
+    recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        transaction.on_commit(lambda: update_search_index(recipe_ids))
@@ -0,0 +1,311 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from threading import Lock
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import IngredientInRecipe, Recipe, SimilarRecipe, TagInRecipe
+
+logger = logging.getLogger(__name__)
+
+# Сходство — взвешенная сумма коэффициентов Жаккара по ингредиентам
+# и по тегам; рецепты без общих ингредиентов соседями не считаются.
+INGREDIENT_WEIGHT = 0.8
+TAG_WEIGHT = 0.2
+# Ячеек матрицы общих ингредиентов в одном блоке, около 32 МБ.
+BLOCK_CELLS = 1 << 22
+BATCH_SIZE = 5000
+
+_executor = None
+_executor_lock = Lock()
+_pending = set()
+_pending_lock = Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SIMILAR_RECIPES_WORKERS,
+                thread_name_prefix='similar-recipes'
+            )
+        return _executor
+
+
+def pairs_array(queryset):
+    return np.fromiter(
+        chain.from_iterable(queryset.iterator()), dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def similarity(shared, sizes, candidate_sizes, shared_tags, tag_sizes,
+               candidate_tag_sizes):
+    """Матрица сходства рецептов (строки) с кандидатами (столбцы).
+
+    shared и shared_tags — число общих ингредиентов и тегов, sizes
+    и candidate_sizes, tag_sizes и candidate_tag_sizes — число
+    ингредиентов и тегов у рецептов и у кандидатов. Блоки велики,
+    поэтому всё считается в float32 на месте.
+    """
+    shared = shared.astype(np.float32)
+    score = np.add.outer(
+        sizes.astype(np.float32), candidate_sizes.astype(np.float32)
+    )
+    score -= shared
+    np.maximum(score, 1, out=score)
+    np.divide(shared, score, out=score)
+    score *= INGREDIENT_WEIGHT
+    shared_tags = shared_tags.astype(np.float32)
+    union = np.add.outer(
+        np.asarray(tag_sizes, dtype=np.float32),
+        np.asarray(candidate_tag_sizes, dtype=np.float32)
+    )
+    union -= shared_tags
+    np.maximum(union, 1, out=union)
+    shared_tags /= union
+    shared_tags *= TAG_WEIGHT
+    np.add(score, shared_tags, out=score, where=shared > 0)
+    return score
+
+
+def top_neighbors(score, count):
+    """Позиции и оценки count лучших кандидатов в каждой строке score.
+
+    При равных оценках первым идёт кандидат с меньшей позицией.
+    """
+    count = min(count, score.shape[1])
+    top = np.argpartition(-score, count - 1, axis=1)[:, :count]
+    top_scores = np.take_along_axis(score, top, axis=1)
+    order = np.lexsort((top, -top_scores))
+    return (
+        np.take_along_axis(top, order, axis=1),
+        np.take_along_axis(top_scores, order, axis=1),
+    )
+
+
+def load_catalog():
+    """Рецепты в виде разреженной матрицы рецепт × ингредиент.
+
+    Матрица хранится дважды в формате CSR: по рецептам (row_ptr,
+    row_ingredients) и по ингредиентам (posting_ptr, posting_recipes —
+    отсортированные позиции рецептов с этим ингредиентом). Теги —
+    плотная матрица рецепт × тег из нулей и единиц: тегов немного,
+    и берутся все, а не только поместившиеся в tags_mask.
+    """
+    ids = np.fromiter(
+        Recipe.objects.order_by('id').values_list('id', flat=True).iterator(),
+        dtype=np.int64
+    )
+    pairs = pairs_array(IngredientInRecipe.objects.order_by().values_list(
+        'recipe_id', 'ingredient_id'
+    ).distinct())
+    tag_pairs = pairs_array(TagInRecipe.objects.order_by().values_list(
+        'recipe_id', 'tag_id'
+    ))
+    tag_ids, tag_columns = np.unique(tag_pairs[:, 1], return_inverse=True)
+    tags = np.zeros((len(ids), len(tag_ids)), dtype=np.float32)
+    tags[
+        np.searchsorted(ids, tag_pairs[:, 0]), tag_columns.reshape(-1)
+    ] = 1
+    rows = np.searchsorted(ids, pairs[:, 0])
+    _, columns = np.unique(pairs[:, 1], return_inverse=True)
+    columns = columns.reshape(-1)
+    by_row = np.lexsort((columns, rows))
+    by_column = np.lexsort((rows, columns))
+    return {
+        'ids': ids,
+        'tags': tags,
+        'row_ptr': np.concatenate((
+            [0], np.cumsum(np.bincount(rows, minlength=len(ids)))
+        )),
+        'row_ingredients': columns[by_row],
+        'posting_ptr': np.concatenate((
+            [0], np.cumsum(np.bincount(columns))
+        )).astype(np.int64),
+        'posting_recipes': rows[by_column],
+    }
+
+
+def shared_counts(catalog, start, end):
+    """Матрица (end - start) × n: число общих ингредиентов рецептов.
+
+    Для каждого ингредиента рецептов блока берётся его список рецептов;
+    пары (строка блока, рецепт) считаются одним bincount.
+    """
+    total = len(catalog['ids'])
+    row_ptr = catalog['row_ptr']
+    posting_ptr = catalog['posting_ptr']
+    ingredients = catalog['row_ingredients'][row_ptr[start]:row_ptr[end]]
+    owners = np.repeat(
+        np.arange(end - start), np.diff(row_ptr[start:end + 1])
+    )
+    starts = posting_ptr[ingredients]
+    lengths = posting_ptr[ingredients + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    offsets += np.arange(len(offsets))
+    keys = np.repeat(owners, lengths) * total
+    keys += catalog['posting_recipes'][offsets]
+    return np.bincount(
+        keys, minlength=(end - start) * total
+    ).reshape(end - start, total)
+
+
+def block_neighbors(catalog, start, end, count):
+    """Соседи рецептов с позициями start..end-1.
+
+    Возвращает массивы id рецептов, id соседей и оценок сходства.
+    """
+    sizes = np.diff(catalog['row_ptr'])
+    tags = catalog['tags']
+    tag_sizes = tags.sum(axis=1)
+    score = similarity(
+        shared_counts(catalog, start, end), sizes[start:end], sizes,
+        tags[start:end] @ tags.T, tag_sizes[start:end], tag_sizes
+    )
+    score[np.arange(end - start), np.arange(start, end)] = 0
+    top, top_scores = top_neighbors(score, count)
+    found = top_scores > 0
+    rows = np.broadcast_to(np.arange(start, end)[:, None], top.shape)
+    ids = catalog['ids']
+    return ids[rows[found]], ids[top[found]], top_scores[found]
+
+
+def block_bounds(catalog, block_size=None):
+    total = len(catalog['ids'])
+    block_size = block_size or max(1, BLOCK_CELLS // max(total, 1))
+    return [
+        (start, min(start + block_size, total))
+        for start in range(0, total, block_size)
+    ]
+
+
+def save_neighbors(blocks):
+    """Заменяет таблицу соседей результатами блоков."""
+    saved = 0
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        for recipe_ids, similar_ids, scores in blocks:
+            objects = [
+                SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                              score=score)
+                for recipe_id, similar_id, score in zip(
+                    recipe_ids.tolist(), similar_ids.tolist(),
+                    scores.tolist()
+                )
+            ]
+            SimilarRecipe.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+            saved += len(objects)
+    return saved
+
+
+def count_subquery(queryset):
+    """Число строк queryset для рецепта OuterRef('pk'), 0 — если их нет."""
+    return Coalesce(Subquery(
+        queryset.filter(recipe_id=OuterRef('pk')).order_by().values(
+            'recipe_id'
+        ).annotate(count=Count('*')).values('count')
+    ), 0)
+
+
+def update_similar_recipes(recipe_id, count=None):
+    """Пересчитывает соседей одного рецепта.
+
+    Кандидаты — рецепты хотя бы с одним общим ингредиентом; их число
+    общих ингредиентов и тегов и размеры считаются запросами к БД,
+    сходство — так же, как в build_similar_recipes. Списки соседей
+    других рецептов не меняются до следующего полного построения.
+    """
+    count = count or settings.SIMILAR_RECIPES_COUNT
+    ingredient_ids = list(IngredientInRecipe.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', flat=True).distinct())
+    tag_ids = list(TagInRecipe.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('tag_id', flat=True))
+    tags = TagInRecipe.objects.all()
+    candidates = Recipe.objects.filter(
+        recipe_ingredients__ingredient_id__in=ingredient_ids
+    ).exclude(pk=recipe_id).annotate(
+        shared=Count('recipe_ingredients__ingredient_id', distinct=True),
+        size=Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe_id=OuterRef('pk')
+            ).order_by().values('recipe_id').annotate(
+                size=Count('ingredient_id', distinct=True)
+            ).values('size')
+        ),
+        tags_count=count_subquery(tags),
+        shared_tags=(
+            count_subquery(tags.filter(tag_id__in=tag_ids)) if tag_ids
+            else Value(0)
+        ),
+    ).order_by('id').values_list(
+        'id', 'shared', 'size', 'tags_count', 'shared_tags'
+    )
+    candidates = np.array(list(candidates), dtype=np.int64).reshape(-1, 5)
+    with transaction.atomic():
+        exists = Recipe.objects.select_for_update().filter(
+            pk=recipe_id
+        ).values_list('id', flat=True).first()
+        SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+        if exists is None or not len(candidates):
+            return 0
+        score = similarity(
+            candidates[None, :, 1], np.array([len(ingredient_ids)]),
+            candidates[:, 2], candidates[None, :, 4],
+            np.array([len(tag_ids)]), candidates[:, 3]
+        )
+        top, top_scores = top_neighbors(score, count)
+        objects = [
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for similar_id, score in zip(
+                candidates[top[0], 0].tolist(), top_scores[0].tolist()
+            ) if score > 0
+        ]
+        SimilarRecipe.objects.bulk_create(objects)
+    return len(objects)
+
+
+def _run(recipe_id):
+    close_old_connections()
+    try:
+        with _pending_lock:
+            # Изменения во время пересчёта поставят рецепт в очередь снова.
+            _pending.discard(recipe_id)
+        update_similar_recipes(recipe_id)
+    except Exception:
+        logger.exception(
+            'Не удалось пересчитать похожие рецепты для %s', recipe_id
+        )
+    finally:
+        close_old_connections()
+
+
+def schedule_similar_recipes(recipe_id):
+    """Ставит пересчёт соседей рецепта в пул потоков после фиксации.
+
+    Рецепт, уже ждущий пересчёта, повторно не ставится. В очереди не
+    больше SIMILAR_RECIPES_QUEUE_SIZE рецептов; остальные пересчитает
+    команда build_similar_recipes.
+    """
+    def submit():
+        with _pending_lock:
+            if recipe_id in _pending:
+                return
+            if len(_pending) >= settings.SIMILAR_RECIPES_QUEUE_SIZE:
+                logger.warning(
+                    'Очередь похожих рецептов заполнена, рецепт %s пропущен',
+                    recipe_id
+                )
+                return
+            _pending.add(recipe_id)
+        get_executor().submit(_run, recipe_id)
+
+    transaction.on_commit(submit)
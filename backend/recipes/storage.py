@@ -0,0 +1,76 @@
+import hashlib
+import os
+import posixpath
+from threading import Lock
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+_stats_lock = Lock()
+stats = {
+    'writes': 0,
+    'bytes_written': 0,
+    'deduplicated': 0,
+    'bytes_deduplicated': 0,
+}
+
+
+def record(writes, size):
+    with _stats_lock:
+        if writes:
+            stats['writes'] += 1
+            stats['bytes_written'] += size
+        else:
+            stats['deduplicated'] += 1
+            stats['bytes_deduplicated'] += size
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, в котором имя файла — хеш его содержимого.
+
+    Одинаковые байты хранятся один раз: повторная загрузка лишь
+    возвращает имя уже записанного файла. Ссылками на файл служат поля
+    моделей, которые его хранят; файлы без ссылок удаляет команда
+    collect_recipe_images.
+    """
+
+    hash_algorithm = 'sha256'
+
+    def hash_content(self, content):
+        digest = hashlib.new(self.hash_algorithm)
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def content_name(self, name, content):
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        digest = self.hash_content(content)
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Свежая ссылка: сборщик не тронет файл в течение --min-age.
+            os.utime(self.path(name))
+            record(False, content.size)
+            return name
+        saved = self._save(name, content)
+        if saved != name:
+            # Тот же файл параллельно записал другой процесс.
+            self.delete(saved)
+            record(False, content.size)
+            return name
+        record(True, content.size)
+        return name
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,129 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = 'recipes/thumbnails'
+FORMATS = (
+    ('jpeg', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    ('webp', 'webp', {'quality': 80, 'method': 4}),
+)
+
+_executor = None
+_executor_lock = Lock()
+_slots = BoundedSemaphore(settings.THUMBNAIL_QUEUE_SIZE)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails'
+            )
+        return _executor
+
+
+def thumbnail_name(source, width, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'{THUMBNAILS_DIR}/{stem}_{width}.{extension}'
+
+
+def render_variants(source, overwrite=False):
+    """Строит уменьшенные копии изображения source во всех форматах.
+
+    Возвращает {ширина: {формат: имя файла в хранилище}}. Имена превью
+    выводятся из имени источника, поэтому уже построенные превью той же
+    картинки переиспользуются без повторного декодирования.
+    """
+    names = {
+        str(width): {
+            image_format: thumbnail_name(source, width, extension)
+            for image_format, extension, _ in FORMATS
+        } for width in settings.RECIPE_THUMBNAIL_WIDTHS
+    }
+    if not overwrite and all(
+        default_storage.exists(name)
+        for variants in names.values() for name in variants.values()
+    ):
+        return names
+    with default_storage.open(source, 'rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    for width in settings.RECIPE_THUMBNAIL_WIDTHS:
+        image = original.copy()
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+        for image_format, extension, options in FORMATS:
+            converted = image
+            if image_format == 'jpeg' and image.mode != 'RGB':
+                converted = image.convert('RGB')
+            buffer = BytesIO()
+            converted.save(buffer, image_format, **options)
+            name = names[str(width)][image_format]
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+    return names
+
+
+def generate_thumbnails(recipe_id, overwrite=False):
+    """Генерирует превью рецепта и сохраняет их имена в Recipe.thumbnails.
+
+    Если за время работы картинка рецепта сменилась, результат
+    отбрасывается: новую картинку обработает следующая задача.
+    """
+    from .models import Recipe
+
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return None
+    source = recipe.image.name
+    variants = render_variants(source, overwrite)
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update().only(
+            'image', 'thumbnails'
+        ).filter(pk=recipe_id).first()
+        if recipe is None or recipe.image.name != source:
+            return None
+        recipe.thumbnails = {'source': source, 'sizes': variants}
+        recipe.save(update_fields=('thumbnails',))
+    return recipe.thumbnails
+
+
+def _run(recipe_id):
+    close_old_connections()
+    try:
+        generate_thumbnails(recipe_id)
+    except Exception:
+        logger.exception('Не удалось построить превью рецепта %s', recipe_id)
+    finally:
+        close_old_connections()
+        _slots.release()
+
+
+def schedule_thumbnails(recipe_id):
+    """Ставит генерацию превью в пул потоков после фиксации транзакции.
+
+    Очередь ограничена THUMBNAIL_QUEUE_SIZE задачами; если она занята,
+    задача отбрасывается, и превью догенерирует команда
+    generate_thumbnails.
+    """
+    def submit():
+        if not _slots.acquire(blocking=False):
+            logger.warning(
+                'Очередь превью заполнена, рецепт %s пропущен', recipe_id
+            )
+            return
+        get_executor().submit(_run, recipe_id)
+
+    transaction.on_commit(submit)
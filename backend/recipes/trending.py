@@ -0,0 +1,117 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Favorite, ShoppingCart, TrendingRecipe, TrendingState
+
+# Рецепт из списка покупок скорее приготовят, чем отложенный в избранное.
+TRENDING_WEIGHTS = {
+    Favorite: 1.0,
+    ShoppingCart: 2.0,
+}
+# Меньшие счета (одно добавление в избранное примерно семь периодов
+# полураспада назад) пересчёт удаляет из таблицы.
+MIN_SCORE = 0.01
+BATCH_SIZE = 5000
+
+
+def growth(moment, epoch):
+    """Множитель вклада события в момент moment относительно эпохи."""
+    half_life = settings.TRENDING_HALF_LIFE_HOURS * 60 * 60
+    return 2 ** ((moment - epoch).total_seconds() / half_life)
+
+
+def locked_epoch():
+    """Текущая эпоха счёта; до конца транзакции она не сменится.
+
+    Строка состояния читается FOR SHARE: добавления друг друга не ждут,
+    а renormalize берёт её FOR UPDATE и ждёт их фиксации, поэтому вклад
+    от старой эпохи не может попасть в уже пересчитанную таблицу.
+    В SQLite запись и так последовательна.
+    """
+    lock = ' FOR SHARE' if connection.features.has_select_for_update else ''
+    state = next(iter(TrendingState.objects.raw(
+        f'SELECT id, epoch FROM {TrendingState._meta.db_table} '
+        f'ORDER BY id LIMIT 1{lock}'
+    )), None)
+    if state is None:
+        state = TrendingState.objects.create(epoch=timezone.now())
+    return state.epoch
+
+
+def change_trending(recipe_id, weight, created_at):
+    """Прибавляет к счёту рецепта вклад события веса weight.
+
+    Отрицательный вес снимает вклад удалённого события с тем же
+    created_at. Вызывается в одной транзакции с изменением Favorite
+    или ShoppingCart.
+    """
+    delta = weight * growth(created_at, locked_epoch())
+    updated = TrendingRecipe.objects.filter(recipe_id=recipe_id).update(
+        score=Greatest(F('score') + delta, 0.0)
+    )
+    if updated or delta <= 0:
+        return
+    _, created = TrendingRecipe.objects.get_or_create(
+        recipe_id=recipe_id, defaults={'score': delta}
+    )
+    if not created:
+        TrendingRecipe.objects.filter(recipe_id=recipe_id).update(
+            score=F('score') + delta
+        )
+
+
+def order_by_trending(queryset):
+    """Рецепты со счётом популярности, от самых популярных сейчас.
+
+    Порядок (score, recipe) совпадает с индексом trending_score_idx,
+    поэтому страница читается из него без обращения к таблице счетов.
+    """
+    return queryset.filter(trending__score__gt=0).order_by(
+        '-trending__score', '-trending__recipe_id'
+    )
+
+
+def renormalize(rebuild=False):
+    """Переносит эпоху на текущий момент и удаляет угасшие счета.
+
+    С rebuild счета заново считаются по created_at всех записей
+    избранного и списков покупок (например, после удаления
+    пользователей). Возвращает число оставшихся счетов и число
+    отброшенных угасших.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        state = TrendingState.objects.select_for_update().order_by(
+            'id'
+        ).first() or TrendingState(epoch=now)
+        if rebuild:
+            scores = defaultdict(float)
+            for model, weight in TRENDING_WEIGHTS.items():
+                for recipe_id, created_at in model.objects.values_list(
+                    'recipe_id', 'created_at'
+                ).iterator():
+                    scores[recipe_id] += weight * growth(created_at, now)
+            TrendingRecipe.objects.all().delete()
+            objects = [
+                TrendingRecipe(recipe_id=recipe_id, score=score)
+                for recipe_id, score in scores.items()
+                if score >= MIN_SCORE
+            ]
+            TrendingRecipe.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+            kept, removed = len(objects), len(scores) - len(objects)
+        else:
+            kept = TrendingRecipe.objects.update(
+                score=F('score') * growth(state.epoch, now)
+            )
+            removed, _ = TrendingRecipe.objects.filter(
+                score__lt=MIN_SCORE
+            ).delete()
+            kept -= removed
+        state.epoch = now
+        state.save()
+    return kept, removed
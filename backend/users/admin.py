@@ -6,7 +6,8 @@ from .models import CustomUser, Subscribe
 @admin.register(CustomUser)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'email', 'username', 'first_name',
-                    'last_name', 'password')
+                    'last_name', 'password', 'recipes_count',
+                    'followers_count')
     list_filter = ('email', 'username')
     empty_value_display = '-пусто-'
     search_fields = ('email', 'username')
@@ -1,13 +1,16 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from foodgram.db.models import DerivedFieldsMixin
+
 from .constant import LENGTH_EMAIL, LENGTH_USER
 
 
-class CustomUser(AbstractUser):
+class CustomUser(DerivedFieldsMixin, AbstractUser):
     """Кастомная модель пользователя."""
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    DERIVED_FIELDS = frozenset({'recipes_count', 'followers_count'})
 
     email = models.EmailField(
         verbose_name='Почта',
@@ -22,6 +25,16 @@ class CustomUser(AbstractUser):
         verbose_name='Фамилия',
         max_length=LENGTH_USER,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -57,6 +70,10 @@ class Subscribe(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_follow'),
         )
+        indexes = (
+            models.Index(fields=('author', 'user'),
+                         name='subscribe_author_user_idx'),
+        )
         ordering = ('-user',)
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'